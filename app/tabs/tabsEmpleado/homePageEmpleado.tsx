@@ -16,8 +16,22 @@ export default function HomePage() {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetch('http://localhost:8080/api/solicitudes')
-      .then(res => res.json())
+    // El listado viene paginado: se siguen las páginas con el header X-Next-Cursor
+    const cargarTodas = async () => {
+      const todas: any[] = [];
+      let cursor: string | null = null;
+      do {
+        const params = new URLSearchParams({ limit: '1000' });
+        if (cursor) params.set('cursor', cursor);
+        const res: Response = await fetch(`http://localhost:8080/api/solicitudes?${params}`);
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        todas.push(...(await res.json()));
+        cursor = res.headers.get('X-Next-Cursor');
+      } while (cursor);
+      return todas;
+    };
+
+    cargarTodas()
       .then(data => setSolicitudes(data))
       .catch(err => {
         Alert.alert('Error', 'No se pudieron cargar las solicitudes');
@@ -0,0 +1,290 @@
+"""
+Benchmark de la API: levanta backend/main.py con uvicorn contra un MongoDB
+local, siembra datos y mide throughput, latencias p50/p95/p99 y RSS máximo
+para listar, buscar, subir, descargar y firmar.
+
+Uso (desde backend/):
+    python -m benchmarks.api_bench --solicitudes 20000 --pdfs 200 --salida bench.json
+
+Si no hay un MongoDB escuchando en --mongo-uri y `mongod` está en el PATH, se
+inicia uno temporal. Cada corrida usa su propia base (--db) y la elimina al
+terminar salvo que se pase --conservar.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from benchmarks.seed import BACKEND_DIR, CATEGORIAS, ESTADOS, generar_pdf, sembrar_solicitudes, sembrar_usuarios
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _mongo_disponible(uri: str) -> bool:
+    client = MongoClient(uri, serverSelectionTimeoutMS=1500)
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+def _iniciar_mongod() -> Optional[tuple]:
+    """Levantar un mongod temporal; devuelve (proceso, uri, directorio) o None"""
+    binario = shutil.which('mongod')
+    if binario is None:
+        return None
+    directorio = tempfile.mkdtemp(prefix='bench-mongod-')
+    puerto = _puerto_libre()
+    proceso = subprocess.Popen(
+        [binario, '--dbpath', directorio, '--port', str(puerto), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    uri = f'mongodb://127.0.0.1:{puerto}/'
+    for _ in range(100):
+        if _mongo_disponible(uri):
+            return proceso, uri, directorio
+        time.sleep(0.2)
+    proceso.terminate()
+    return None
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    # Método nearest-rank
+    indice = min(len(ordenados) - 1, max(0, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+def _rss_kb(pid: int, campo: str = 'VmHWM') -> int:
+    # VmHWM es el máximo de RSS del proceso desde que inició (solo Linux)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linea in f:
+                if linea.startswith(campo + ':'):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _descendientes(pid: int) -> List[int]:
+    hijos = []
+    try:
+        for tarea in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tarea}/children') as f:
+                hijos.extend(int(h) for h in f.read().split())
+    except OSError:
+        return []
+    return hijos + [n for h in hijos for n in _descendientes(h)]
+
+async def medir_escenario(
+    nombre: str,
+    peticion: Callable[[int], Awaitable[httpx.Response]],
+    total: int,
+    concurrencia: int
+) -> Dict[str, float]:
+    """Ejecutar total peticiones con la concurrencia dada y resumir sus latencias"""
+    latencias = []
+    errores = 0
+    siguiente = iter(range(total))
+
+    async def trabajador():
+        nonlocal errores
+        for i in siguiente:
+            inicio = time.perf_counter()
+            try:
+                respuesta = await peticion(i)
+                if respuesta.status_code >= 400:
+                    errores += 1
+            except httpx.HTTPError:
+                errores += 1
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+    resultado = {
+        'peticiones': total,
+        'errores': errores,
+        'duracion_s': round(duracion, 3),
+        'throughput_rps': round(total / duracion, 2) if duracion else 0.0,
+        'p50_ms': round(_percentil(latencias, 50) * 1000, 2),
+        'p95_ms': round(_percentil(latencias, 95) * 1000, 2),
+        'p99_ms': round(_percentil(latencias, 99) * 1000, 2),
+    }
+    print(f"{nombre:<22} {resultado['throughput_rps']:>9} req/s  p50 {resultado['p50_ms']} ms  "
+          f"p95 {resultado['p95_ms']} ms  p99 {resultado['p99_ms']} ms  errores {errores}")
+    return resultado
+
+async def ejecutar(args, base_url: str, pdfs: List[bytes]) -> Dict[str, Dict[str, float]]:
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limites) as client:
+        # Subida: también deja los documentos que usan descargar y firmar
+        documento_ids = []
+
+        async def subir(i):
+            pdf = pdfs[i % len(pdfs)]
+            respuesta = await client.post(
+                '/api/agregarPDF',
+                data={'solicitud_id': f'bench-{i % 100}', 'filename': f'bench_{i}.pdf'},
+                files={'file': (f'bench_{i}.pdf', pdf, 'application/pdf')}
+            )
+            if respuesta.status_code == 200:
+                documento_ids.append(respuesta.json()['file_id'])
+            return respuesta
+
+        async def listar_solicitudes(i):
+            return await client.get('/api/solicitudes', params={'limit': 100})
+
+        async def buscar_solicitudes(i):
+            return await client.get('/api/solicitudes/buscar', params={
+                'estado': ESTADOS[i % len(ESTADOS)],
+                'categoria': CATEGORIAS[i % len(CATEGORIAS)],
+                'limit': 100
+            })
+
+        async def listar_usuarios(i):
+            return await client.get('/api/usuarios', params={'limit': 100})
+
+        async def listar_pendientes(i):
+            return await client.get('/api/documentos/pendientes', params={'limit': 100})
+
+        async def descargar(i):
+            return await client.get(f'/api/documentos/{documento_ids[i % len(documento_ids)]}/descargar')
+
+        async def firmar(i):
+            return await client.post(
+                '/api/documentos/firmar-pdf',
+                data={'nombre': 'Bench', 'rut': '11.111.111-1', 'correo': 'bench@empresa.cl'},
+                files={'file': ('bench.pdf', pdfs[i % len(pdfs)], 'application/pdf')}
+            )
+
+        escenarios = [
+            ('subir_pdf', subir, args.pdfs),
+            ('listar_solicitudes', listar_solicitudes, args.peticiones),
+            ('buscar_solicitudes', buscar_solicitudes, args.peticiones),
+            ('listar_usuarios', listar_usuarios, args.peticiones),
+            ('listar_pendientes', listar_pendientes, args.peticiones),
+            ('descargar_pdf', descargar, args.peticiones),
+            ('firmar_pdf', firmar, max(1, args.peticiones // 10)),
+        ]
+        resultados = {}
+        for nombre, peticion, total in escenarios:
+            if nombre == 'descargar_pdf' and not documento_ids:
+                continue
+            resultados[nombre] = await medir_escenario(nombre, peticion, total, args.concurrencia)
+        return resultados
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la API de FirmaSimple')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--db', default='FirmaSimpleBench')
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--solicitudes', type=int, default=20000)
+    parser.add_argument('--pdfs', type=int, default=100, help='PDFs subidos en el escenario subir_pdf')
+    parser.add_argument('--paginas', default='1,5,20', help='Páginas de los PDFs generados, separadas por coma')
+    parser.add_argument('--peticiones', type=int, default=500, help='Peticiones por escenario de lectura')
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--salida', default=None, help='Archivo JSON con los resultados')
+    parser.add_argument('--conservar', action='store_true', help='No eliminar la base al terminar')
+    args = parser.parse_args()
+
+    mongod = None
+    if not _mongo_disponible(args.mongo_uri):
+        mongod = _iniciar_mongod()
+        if mongod is None:
+            sys.exit(f'MongoDB no disponible en {args.mongo_uri} y no se encontró mongod en el PATH')
+        args.mongo_uri = mongod[1]
+
+    client = MongoClient(args.mongo_uri)
+    client.drop_database(args.db)
+    db = client[args.db]
+    inicio = time.perf_counter()
+    sembrar_usuarios(db, args.usuarios)
+    sembrar_solicitudes(args.mongo_uri, args.db, args.solicitudes)
+    print(f'Sembrado: {args.usuarios} usuarios, {args.solicitudes} solicitudes en {time.perf_counter() - inicio:.1f} s')
+
+    paginas = [int(p) for p in args.paginas.split(',') if p.strip()]
+    # Un PDF distinto por subida para que la deduplicación no esconda el costo de escritura
+    pdfs = [generar_pdf(paginas[i % len(paginas)], i) for i in range(max(args.pdfs, len(paginas)))]
+
+    puerto = _puerto_libre()
+    env = dict(os.environ, MONGODB_URI=args.mongo_uri, MONGO_DB=args.db)
+    servidor = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(puerto), '--log-level', 'warning'],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    base_url = f'http://127.0.0.1:{puerto}'
+    try:
+        for _ in range(150):
+            try:
+                if httpx.get(f'{base_url}/metrics', timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if servidor.poll() is not None:
+                sys.exit('El backend terminó durante el arranque')
+            time.sleep(0.2)
+
+        resultados = asyncio.run(ejecutar(args, base_url, pdfs))
+        rss_pool = sum(_rss_kb(pid) for pid in _descendientes(servidor.pid))
+        reporte = {
+            'commit': _commit(),
+            'fecha': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'config': {
+                'usuarios': args.usuarios,
+                'solicitudes': args.solicitudes,
+                'pdfs': args.pdfs,
+                'paginas': paginas,
+                'tamanos_pdf_kb': sorted({round(len(p) / 1024) for p in pdfs}),
+                'peticiones': args.peticiones,
+                'concurrencia': args.concurrencia,
+            },
+            'peak_rss_mb': round(_rss_kb(servidor.pid) / 1024, 1),
+            'peak_rss_pool_pdf_mb': round(rss_pool / 1024, 1),
+            'escenarios': resultados,
+        }
+        print(f"RSS máximo: backend {reporte['peak_rss_mb']} MB, pool PDF {reporte['peak_rss_pool_pdf_mb']} MB")
+        if args.salida:
+            with open(args.salida, 'w') as f:
+                json.dump(reporte, f, indent=2, ensure_ascii=False)
+            print(f'Resultados guardados en {args.salida}')
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=30)
+        if not args.conservar:
+            client.drop_database(args.db)
+        client.close()
+        if mongod is not None:
+            mongod[0].terminate()
+            mongod[0].wait(timeout=30)
+            shutil.rmtree(mongod[2], ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
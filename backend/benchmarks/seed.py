@@ -0,0 +1,321 @@
+"""
+Generador de datos sintéticos para pruebas de escala: usuarios, solicitudes y
+documentos PDF en GridFS con volúmenes y distribuciones realistas.
+
+Uso (desde backend/):
+    python -m benchmarks.seed --db FirmaSimpleEscala --usuarios 50000 \\
+        --solicitudes 2000000 --documentos 20000 --paginas 5,200 --procesos 8
+
+Las solicitudes se insertan con insert_many sin orden, repartidas entre
+procesos; los documentos se suben con GridFSManager (mismo formato que la
+API: deduplicación, códec y blob store configurados) usando varios
+escritores concurrentes por proceso. Los índices se crean después de cargar
+usuarios y solicitudes, que es bastante más rápido que mantenerlos durante la
+carga masiva, pero antes de los documentos: la deduplicación consulta
+blobs.files por hash en cada subida.
+"""
+import argparse
+import asyncio
+import io
+import math
+import os
+import random
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from lib.modelos import RolUsuario
+
+# Proporción de cada rol entre los usuarios generados
+ROLES_PESOS = {RolUsuario.EMPLEADO: 0.80, RolUsuario.SUPERVISOR: 0.15, RolUsuario.HR: 0.05}
+CATEGORIAS = ['vacaciones', 'licencia', 'permiso', 'viatico', 'capacitacion']
+CATEGORIAS_PESOS = [0.35, 0.25, 0.20, 0.12, 0.08]
+ESTADOS = ['pendiente', 'aprobado', 'rechazado']
+ESTADOS_PESOS = [0.25, 0.65, 0.10]
+NOMBRES = ['Ana', 'Benjamín', 'Camila', 'Diego', 'Fernanda', 'Gonzalo', 'Isidora', 'Joaquín', 'Martina', 'Tomás']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda']
+# Más solicitudes de vacaciones en verano (enero, febrero) y fin de año
+FACTOR_MES = [1.6, 1.5, 0.9, 0.9, 0.9, 0.8, 1.1, 0.9, 1.0, 0.9, 1.0, 1.4]
+
+def fecha_realista(rnd: random.Random, desde: datetime, dias: int) -> datetime:
+    """
+    Fecha con crecimiento en el tiempo (más solicitudes recientes), estacionalidad
+    mensual, pocas solicitudes en fin de semana y concentración en horario laboral
+    """
+    while True:
+        # Densidad creciente lineal: sqrt de una uniforme
+        dia = desde + timedelta(days=int(math.sqrt(rnd.random()) * dias))
+        peso = FACTOR_MES[dia.month - 1] / max(FACTOR_MES)
+        if dia.weekday() >= 5:
+            peso *= 0.1
+        if rnd.random() < peso:
+            break
+    # Horario laboral con un máximo a media mañana
+    hora = rnd.gauss(11.5, 2.5)
+    while not 8 <= hora < 20:
+        hora = rnd.gauss(11.5, 2.5)
+    return dia + timedelta(hours=hora, seconds=rnd.randrange(60))
+
+def _ascii(texto: str) -> str:
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+
+def generar_usuarios(n: int, rnd: random.Random) -> List[dict]:
+    roles = list(ROLES_PESOS)
+    pesos = list(ROLES_PESOS.values())
+    usuarios = []
+    for i in range(n):
+        nombre = f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)}'
+        usuarios.append({
+            'nombre': nombre,
+            'correo': f"{_ascii(nombre.split()[0]).lower()}.{i}@empresa.cl",
+            'rol': rnd.choices(roles, pesos)[0].value,
+            'contraseña': 'x'
+        })
+    return usuarios
+
+def sembrar_usuarios(db, n: int, seed: int = 1, lote: int = 10000) -> None:
+    rnd = random.Random(seed)
+    usuarios = generar_usuarios(n, rnd)
+    for i in range(0, len(usuarios), lote):
+        db['Usuarios'].insert_many(usuarios[i:i + lote], ordered=False)
+
+def _por_rol(db) -> Dict[str, List[dict]]:
+    # Una muestra acotada alcanza para asignar empleados, supervisores y hr
+    grupos = {rol.value: [] for rol in RolUsuario}
+    for doc in db['Usuarios'].find({}, {'nombre': 1, 'correo': 1, 'rol': 1}).limit(20000):
+        # Misma forma que guarda add_solicitud: referencia por id más correo y nombre
+        grupos[doc['rol']].append({'id': doc['_id'], 'correo': doc['correo'], 'nombre': doc['nombre']})
+    return grupos
+
+def _sembrar_solicitudes_parte(uri: str, db_name: str, desde_indice: int, n: int, lote: int, seed: int) -> int:
+    client = MongoClient(uri)
+    db = client[db_name]
+    rnd = random.Random(seed * 1000003 + desde_indice)
+    grupos = _por_rol(db)
+    todos = [u for grupo in grupos.values() for u in grupo]
+    if not todos:
+        raise RuntimeError('Se necesitan usuarios antes de sembrar solicitudes')
+    empleados = grupos['empleado'] or todos
+    supervisores = grupos['supervisor'] or todos
+    hrs = grupos['hr'] or todos
+    inicio = datetime(2021, 1, 1)
+    dias = (datetime(2025, 12, 31) - inicio).days
+
+    docs = []
+    for i in range(desde_indice, desde_indice + n):
+        categoria = rnd.choices(CATEGORIAS, CATEGORIAS_PESOS)[0]
+        docs.append({
+            'titulo': f'Solicitud de {categoria} {i}',
+            'categoria': categoria,
+            'descripcion': f'Solicitud de {categoria} número {i} generada para pruebas de escala',
+            'fecha': fecha_realista(rnd, inicio, dias).isoformat(),
+            'estado': rnd.choices(ESTADOS, ESTADOS_PESOS)[0],
+            'empleado': rnd.choice(empleados),
+            'supervisor': rnd.choice(supervisores),
+            'hr': rnd.choice(hrs),
+            'documentoId': ''
+        })
+        if len(docs) == lote:
+            db['Solicitudes'].insert_many(docs, ordered=False)
+            docs = []
+    if docs:
+        db['Solicitudes'].insert_many(docs, ordered=False)
+    client.close()
+    return n
+
+def _repartir(total: int, partes: int) -> List[Tuple[int, int]]:
+    """Dividir [0, total) en rangos (inicio, cantidad) para cada proceso"""
+    base, extra = divmod(total, partes)
+    rangos = []
+    inicio = 0
+    for i in range(partes):
+        cantidad = base + (1 if i < extra else 0)
+        if cantidad:
+            rangos.append((inicio, cantidad))
+        inicio += cantidad
+    return rangos
+
+def sembrar_solicitudes(uri: str, db_name: str, n: int, procesos: int = 1, lote: int = 10000, seed: int = 1) -> None:
+    if procesos <= 1:
+        _sembrar_solicitudes_parte(uri, db_name, 0, n, lote, seed)
+        return
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [
+            pool.submit(_sembrar_solicitudes_parte, uri, db_name, inicio, cantidad, lote, seed)
+            for inicio, cantidad in _repartir(n, procesos)
+        ]
+        for futuro in futuros:
+            futuro.result()
+
+@lru_cache(maxsize=None)
+def _plantilla_pdf(paginas: int) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    rnd = random.Random(paginas)
+    for pagina in range(paginas):
+        pdf.setFont('Helvetica', 10)
+        pdf.drawString(72, 740, f'Documento de prueba - página {pagina + 1}/{paginas}')
+        for linea in range(50):
+            pdf.drawString(72, 720 - linea * 13, ' '.join(str(rnd.random()) for _ in range(5)))
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def generar_pdf(paginas: int, semilla: int) -> bytes:
+    """
+    PDF de prueba con la cantidad de páginas pedida
+
+    Se reutiliza una plantilla por cantidad de páginas y se agrega un comentario
+    después de %%EOF con la semilla: cada documento tiene un hash distinto (no se
+    deduplica) sin pagar el costo de generar un PDF nuevo con reportlab.
+    """
+    return _plantilla_pdf(paginas) + f'\n% documento {semilla}\n'.encode()
+
+async def _subir_documentos(solicitudes: List[Tuple[ObjectId, dict]], paginas: Tuple[int, int], escritores: int, firmados: float, seed: int) -> None:
+    from lib.gridfs_manager import gridfs
+    from lib.mongodb import mongodb
+
+    await mongodb.connect()
+    rnd = random.Random(seed)
+    pendientes = iter(solicitudes)
+    vinculos = []
+
+    async def escritor():
+        for solicitud_id, solicitud in pendientes:
+            n_paginas = rnd.randint(*paginas)
+            metadata = {
+                'solicitud_id': str(solicitud_id),
+                'content_type': 'application/pdf',
+                'original_filename': f'solicitud_{solicitud_id}.pdf'
+            }
+            if rnd.random() < firmados:
+                metadata.update({
+                    'firmado': True,
+                    'estado': 'firmado',
+                    'firmado_por': solicitud['supervisor']['correo'],
+                    'fecha_firma': datetime.fromisoformat(solicitud['fecha']) + timedelta(days=rnd.randint(0, 10))
+                })
+            file_id = await gridfs.upload_file(
+                generar_pdf(n_paginas, int(str(solicitud_id), 16)),
+                filename=f'solicitud_{solicitud_id}.pdf',
+                metadata=metadata
+            )
+            vinculos.append(UpdateOne({'_id': solicitud_id}, {'$set': {'documentoId': file_id}}))
+            if len(vinculos) >= 1000:
+                lote = vinculos[:]
+                vinculos.clear()
+                await mongodb.get_database()['Solicitudes'].bulk_write(lote, ordered=False)
+
+    await asyncio.gather(*(escritor() for _ in range(escritores)))
+    if vinculos:
+        await mongodb.get_database()['Solicitudes'].bulk_write(vinculos, ordered=False)
+    mongodb.client.close()
+
+def _sembrar_documentos_parte(uri: str, db_name: str, ids: List[str], paginas: Tuple[int, int], escritores: int, firmados: float, seed: int) -> int:
+    # Cada proceso abre su propio cliente: Motor no sobrevive a un fork
+    os.environ['MONGODB_URI'] = uri
+    os.environ['MONGO_DB'] = db_name
+    client = MongoClient(uri)
+    object_ids = [ObjectId(i) for i in ids]
+    solicitudes = [
+        (doc['_id'], doc)
+        for doc in client[db_name]['Solicitudes'].find({'_id': {'$in': object_ids}}, {'fecha': 1, 'supervisor.correo': 1})
+    ]
+    client.close()
+    asyncio.run(_subir_documentos(solicitudes, paginas, escritores, firmados, seed))
+    return len(solicitudes)
+
+def sembrar_documentos(
+    uri: str,
+    db_name: str,
+    n: int,
+    paginas: Tuple[int, int] = (1, 20),
+    procesos: int = 1,
+    escritores: int = 8,
+    firmados: float = 0.6,
+    seed: int = 1
+) -> None:
+    """Subir n PDFs asociados a las primeras n solicitudes y enlazar su documentoId"""
+    client = MongoClient(uri)
+    ids = [str(doc['_id']) for doc in client[db_name]['Solicitudes'].find({}, {'_id': 1}).limit(n)]
+    client.close()
+    partes = [ids[inicio:inicio + cantidad] for inicio, cantidad in _repartir(len(ids), max(1, procesos))]
+    if procesos <= 1:
+        _sembrar_documentos_parte(uri, db_name, ids, paginas, escritores, firmados, seed)
+        return
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [
+            pool.submit(_sembrar_documentos_parte, uri, db_name, parte, paginas, escritores, firmados, seed + i)
+            for i, parte in enumerate(partes)
+        ]
+        for futuro in futuros:
+            futuro.result()
+
+def crear_indices(uri: str, db_name: str) -> None:
+    os.environ['MONGODB_URI'] = uri
+    os.environ['MONGO_DB'] = db_name
+    from lib.mongodb import mongodb
+
+    async def crear():
+        await mongodb.connect()
+        await mongodb.ensure_indexes()
+        mongodb.client.close()
+    asyncio.run(crear())
+
+def main():
+    parser = argparse.ArgumentParser(description='Generar datos sintéticos de FirmaSimple')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--db', default='FirmaSimpleEscala')
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--solicitudes', type=int, default=1000000)
+    parser.add_argument('--documentos', type=int, default=10000)
+    parser.add_argument('--paginas', default='1,20', help='Rango mínimo,máximo de páginas por PDF')
+    parser.add_argument('--firmados', type=float, default=0.6, help='Proporción de documentos firmados')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--escritores', type=int, default=8, help='Subidas concurrentes a GridFS por proceso')
+    parser.add_argument('--lote', type=int, default=10000, help='Documentos por insert_many')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--limpiar', action='store_true', help='Eliminar la base antes de sembrar')
+    args = parser.parse_args()
+
+    minimo, _, maximo = args.paginas.partition(',')
+    paginas = (int(minimo), int(maximo or minimo))
+
+    if args.limpiar:
+        client = MongoClient(args.mongo_uri)
+        client.drop_database(args.db)
+        client.close()
+
+    inicio = time.perf_counter()
+    client = MongoClient(args.mongo_uri)
+    sembrar_usuarios(client[args.db], args.usuarios, args.seed, args.lote)
+    client.close()
+    print(f'Usuarios: {args.usuarios} en {time.perf_counter() - inicio:.1f} s')
+
+    etapa = time.perf_counter()
+    sembrar_solicitudes(args.mongo_uri, args.db, args.solicitudes, args.procesos, args.lote, args.seed)
+    print(f'Solicitudes: {args.solicitudes} en {time.perf_counter() - etapa:.1f} s')
+
+    etapa = time.perf_counter()
+    crear_indices(args.mongo_uri, args.db)
+    print(f'Índices en {time.perf_counter() - etapa:.1f} s')
+
+    etapa = time.perf_counter()
+    sembrar_documentos(args.mongo_uri, args.db, args.documentos, paginas, args.procesos, args.escritores, args.firmados, args.seed)
+    print(f'Documentos: {args.documentos} en {time.perf_counter() - etapa:.1f} s')
+    print(f'Total: {time.perf_counter() - inicio:.1f} s')
+
+if __name__ == '__main__':
+    main()
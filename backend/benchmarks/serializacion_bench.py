@@ -0,0 +1,104 @@
+"""
+Costo de serializar listados por cada 1000 elementos: el camino anterior de
+FastAPI (jsonable_encoder + JSONResponse) contra RespuestaJSON (orjson).
+
+Uso (desde backend/):
+    python -m benchmarks.serializacion_bench --repeticiones 50 --salida serializacion.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from lib.modelos import DocumentoFirmado, UsuarioWithId
+from lib.respuestas import RespuestaJSON
+
+ITEMS = 1000
+
+def _solicitudes() -> List[dict]:
+    # Forma compacta que devuelve _find_solicitudes
+    fecha = datetime(2025, 1, 1)
+    return [
+        {
+            'id': str(ObjectId()),
+            'titulo': f'Solicitud de vacaciones {i}',
+            'categoria': 'vacaciones',
+            'descripcion': f'Solicitud de vacaciones número {i} generada para el benchmark',
+            'fecha': (fecha + timedelta(minutes=i)).isoformat(),
+            'estado': 'pendiente',
+            'empleado': {'id': str(ObjectId()), 'correo': f'empleado{i}@empresa.cl', 'nombre': f'Empleado {i}'},
+            'supervisor': {'id': str(ObjectId()), 'correo': 'jefe@empresa.cl', 'nombre': 'Carlos Ruiz'},
+            'hr': {'id': str(ObjectId()), 'correo': 'rrhh@empresa.cl', 'nombre': 'María Hernández'},
+            'documentoId': str(ObjectId())
+        }
+        for i in range(ITEMS)
+    ]
+
+def _documentos() -> List[DocumentoFirmado]:
+    return [
+        DocumentoFirmado(
+            id=str(ObjectId()),
+            solicitud_id=str(ObjectId()),
+            filename=f'documento_{i}.pdf',
+            content_type='application/pdf',
+            upload_date=datetime(2025, 1, 1) + timedelta(seconds=i),
+            length=100000 + i,
+            firmado=i % 2 == 0,
+            fecha_firma=datetime(2025, 1, 2) if i % 2 == 0 else None,
+            metadata={'tipo': 'documento', 'estado': 'activo', 'sha256': '0' * 64, 'solicitud_id': 'x'}
+        )
+        for i in range(ITEMS)
+    ]
+
+def _usuarios() -> List[UsuarioWithId]:
+    return [
+        UsuarioWithId(id=str(ObjectId()), nombre=f'Usuario {i}', correo=f'usuario{i}@empresa.cl', rol='empleado', contraseña='x')
+        for i in range(ITEMS)
+    ]
+
+def _antes(items) -> bytes:
+    return JSONResponse(jsonable_encoder(items)).body
+
+def _despues(items) -> bytes:
+    return RespuestaJSON(items).body
+
+def _medir(func: Callable, items, repeticiones: int) -> float:
+    func(items)
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func(items)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Costo de serialización por 1000 elementos')
+    parser.add_argument('--repeticiones', type=int, default=30)
+    parser.add_argument('--salida', default=None, help='Archivo JSON con los resultados')
+    args = parser.parse_args()
+
+    resultados: Dict[str, Dict[str, float]] = {}
+    for nombre, items in (('solicitudes', _solicitudes()), ('documentos', _documentos()), ('usuarios', _usuarios())):
+        # Ambos caminos deben producir el mismo JSON
+        assert json.loads(_antes(items)) == json.loads(_despues(items))
+        antes = _medir(_antes, items, args.repeticiones)
+        despues = _medir(_despues, items, args.repeticiones)
+        resultados[nombre] = {
+            'antes_ms': round(antes, 3),
+            'despues_ms': round(despues, 3),
+            'aceleracion': round(antes / despues, 1),
+            'bytes': len(_despues(items))
+        }
+        print(f'{nombre:<12} antes {antes:8.3f} ms  después {despues:8.3f} ms  x{antes / despues:.1f}  (por {ITEMS} elementos)')
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({'items': ITEMS, 'resultados': resultados}, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,113 @@
-from typing import List, Optional
+import base64
+import json
+import os
+import re
+from typing import List, Optional, AsyncIterator, Union, Tuple, Dict, Any, Callable
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
 from bson.errors import InvalidId
-from datetime import datetime
-from .modelos import Usuario, UsuarioSolicitud, UsuarioWithId, Solicitudes, SolicitudCreate, DocumentoFirmado, DocumentoUpload, FirmaDocumento
+from datetime import date, datetime, timedelta
+from .modelos import Usuario, UsuarioSolicitud, UsuarioWithId, SolicitudCreate, DocumentoFirmado, DocumentoUpload, FirmaDocumento, ResultadoFirma, FirmaPdfDocumento, VerificacionDocumento, ErrorFilaUsuario, ResultadoLoteUsuarios
 from .mongodb import mongodb
 from .gridfs_manager import gridfs
+from .cache import LRUCache
+from .firma_pdf import pdf_pool
+from .metricas import medir
 
 SOLICITUDES_COLLECTION = 'Solicitudes'
 USUARIOS_COLLECTION = 'Usuarios'
 
-# Helper para convertir documento de MongoDB a tipo Solicitudes
-def from_mongodb_solicitud(doc: dict) -> Solicitudes:
-    return Solicitudes(
-        id=str(doc['_id']),
-        titulo=doc['titulo'],
-        categoria=doc['categoria'],
-        descripcion=doc['descripcion'],
-        fecha=doc['fecha'],
-        empleado=Usuario(
-            nombre=doc['empleado']['nombre'],
-            correo=doc['empleado']['correo'],
-            rol=doc['empleado']['rol'],
-            contraseña=doc['empleado'].get('contraseña', '')  # Usar get() con valor por defecto
-        ),
-        supervisor=Usuario(
-            nombre=doc['supervisor']['nombre'],
-            correo=doc['supervisor']['correo'],
-            rol=doc['supervisor']['rol'],
-            contraseña=doc['supervisor'].get('contraseña', '')
-        ),
-        hr=Usuario(
-            nombre=doc['hr']['nombre'],
-            correo=doc['hr']['correo'],
-            rol=doc['hr']['rol'],
-            contraseña=doc['hr'].get('contraseña', '')
-        ),
-        documentoId=doc['documentoId']
-    )
+# tipo de la copia que guarda firmar_documento_pdf; los listados muestran solo el
+# original (que queda firmado y apunta a la copia con firmado_id)
+TIPO_VERSION_FIRMADA = 'version_firmada'
+SIN_VERSIONES_FIRMADAS = {'tipo': {'$ne': TIPO_VERSION_FIRMADA}}
+
+# Caché de usuarios por id y por correo; se invalida en add_usuario y delete_usuario
+usuarios_cache = LRUCache(
+    maxsize=int(os.getenv('USUARIO_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USUARIO_CACHE_TTL', 60))
+)
+
+def _cachear_usuario(usuario: UsuarioWithId) -> None:
+    usuarios_cache.set(('id', usuario.id), usuario)
+    usuarios_cache.set(('correo', usuario.correo), usuario)
+
+def _invalidar_usuario(id: Optional[str] = None, correo: Optional[str] = None) -> None:
+    if id:
+        usuarios_cache.invalidate(('id', id))
+    if correo:
+        usuarios_cache.invalidate(('correo', correo))
+
+def get_usuario_cache_stats() -> Dict[str, int]:
+    """Contadores de aciertos, fallos y desalojos del caché de usuarios"""
+    return usuarios_cache.stats()
+
+# Campos que se pueden pedir con fields= en cada listado (campo de la API -> ruta en MongoDB)
+SOLICITUD_FIELDS = {
+    'titulo': 'titulo', 'categoria': 'categoria', 'descripcion': 'descripcion', 'fecha': 'fecha',
+    'empleado': 'empleado', 'supervisor': 'supervisor', 'hr': 'hr', 'documentoId': 'documentoId',
+    'estado': 'estado'
+}
+USUARIO_FIELDS = {'nombre': 'nombre', 'correo': 'correo', 'rol': 'rol', 'contraseña': 'contraseña'}
+DOCUMENTO_FIELDS = {
+    'filename': 'filename', 'length': 'length', 'upload_date': 'uploadDate', 'metadata': 'metadata',
+    'solicitud_id': 'metadata.solicitud_id', 'content_type': 'metadata.content_type',
+    'firmado': 'metadata.firmado', 'firmado_por': 'metadata.firmado_por', 'fecha_firma': 'metadata.fecha_firma'
+}
+
+# Helpers de paginación por cursor (keyset) y proyección de campos
+def encode_cursor(*values) -> str:
+    raw = json.dumps([str(value) if isinstance(value, ObjectId) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decodificar un cursor opaco; el último valor siempre es un _id"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError
+        values[-1] = ObjectId(values[-1])
+        return values
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError("Cursor inválido")
+
+def select_fields(fields: Optional[List[str]], allowed: Dict[str, str]) -> Optional[Dict[str, str]]:
+    if not fields:
+        return None
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Campos no permitidos: {', '.join(unknown)}")
+    return {field: allowed[field] for field in fields}
+
+def _mongo_projection(paths) -> Dict[str, int]:
+    # MongoDB rechaza proyectar 'metadata' y 'metadata.x' a la vez
+    paths = set(paths)
+    return {
+        path: 1 for path in paths
+        if not any(path.startswith(f'{other}.') for other in paths)
+    }
+
+def _get_path(doc: dict, path: str) -> Any:
+    for part in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+def _pick_fields(doc: dict, selected: Dict[str, str]) -> dict:
+    result = {'id': str(doc['_id']) if '_id' in doc else doc['id']}
+    for field, path in selected.items():
+        result[field] = _get_path(doc, path)
+    return result
+
+def _next_page(docs: list, limit: Optional[int], cursor_values: Callable[[dict], tuple]) -> Tuple[list, Optional[str]]:
+    # Se pide limit + 1 documentos: si llega el extra, hay otra página
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(*cursor_values(docs[-1]))
+    return docs, None
 
 def from_mongodb_usuario(doc: dict) -> UsuarioWithId:
     return UsuarioWithId(
@@ -47,30 +118,193 @@ def from_mongodb_usuario(doc: dict) -> UsuarioWithId:
         contraseña=doc['contraseña']
     )
 
+def from_gridfs_documento(file_data: dict) -> DocumentoFirmado:
+    metadata = file_data.get('metadata') or {}
+    firmado_por = metadata.get('firmado_por')
+    return DocumentoFirmado(
+        id=file_data['id'],
+        solicitud_id=metadata.get('solicitud_id', ''),
+        filename=file_data['filename'],
+        content_type=file_data['content_type'],
+        upload_date=file_data['upload_date'],
+        length=file_data['length'],
+        firmado=metadata.get('firmado', False),
+        # firmado_por puede venir como correo (str) desde FirmaDocumento; queda en metadata
+        firmado_por=Usuario(**firmado_por) if isinstance(firmado_por, dict) else None,
+        fecha_firma=metadata.get('fecha_firma'),
+        metadata=metadata
+    )
+
 # Métodos para Solicitudes
-async def get_solicitudes() -> List[Solicitudes]:
-    """Obtener todas las solicitudes ordenadas por fecha descendente"""
+SOLICITUD_USUARIOS = ('empleado', 'supervisor', 'hr')
+# Campos de usuario que se leen de una solicitud: 'id' en las que guardan una
+# referencia; nombre y rol solo existen en las que aún tienen el usuario embebido
+USUARIO_REF_CAMPOS = ('id', 'correo', 'nombre', 'rol')
+SOLICITUD_PROJECTION = _mongo_projection([
+    'titulo', 'categoria', 'descripcion', 'fecha', 'estado', 'documentoId',
+    *(f'{rol}.{campo}' for rol in SOLICITUD_USUARIOS for campo in USUARIO_REF_CAMPOS)
+])
+
+def _solicitud_projection(paths) -> Dict[str, int]:
+    # Los usuarios nunca se proyectan completos: así no sale la contraseña
+    return _mongo_projection([
+        f'{path}.{campo}' if path in SOLICITUD_USUARIOS else path
+        for path in paths
+        for campo in (USUARIO_REF_CAMPOS if path in SOLICITUD_USUARIOS else ('',))
+    ])
+
+def _lookup_usuarios() -> List[dict]:
+    """Etapas de aggregate que reemplazan cada referencia {id, correo, nombre} por el usuario"""
+    stages = []
+    for rol in SOLICITUD_USUARIOS:
+        stages.append({'$lookup': {
+            'from': USUARIOS_COLLECTION,
+            'let': {'usuario_id': f'${rol}.id'},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$usuario_id']}}},
+                {'$project': {'_id': 0, 'nombre': 1, 'correo': 1, 'rol': 1}}
+            ],
+            'as': f'_{rol}'
+        }})
+        # Sin coincidencia (usuario embebido o eliminado) se deja el valor guardado
+        stages.append({'$set': {rol: {'$cond': [
+            {'$gt': [{'$size': f'$_{rol}'}, 0]},
+            {'$mergeObjects': [{'id': f'${rol}.id'}, {'$arrayElemAt': [f'$_{rol}', 0]}]},
+            f'${rol}'
+        ]}}})
+    stages.append({'$project': {f'_{rol}': 0 for rol in SOLICITUD_USUARIOS}})
+    return stages
+
+def _solicitud_compacta(doc: dict) -> dict:
+    """Dejar un documento proyectado listo para serializar, sin construir modelos"""
+    doc['id'] = str(doc.pop('_id'))
+    for rol in SOLICITUD_USUARIOS:
+        usuario = doc.get(rol)
+        if isinstance(usuario, dict) and 'id' in usuario:
+            usuario['id'] = str(usuario['id'])
+    return doc
+
+async def _find_solicitudes(
+    query: dict,
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[List[str]],
+    expandir: bool = False
+) -> Tuple[List[dict], Optional[str]]:
+    selected = select_fields(fields, SOLICITUD_FIELDS)
+    if cursor:
+        fecha, last_id = decode_cursor(cursor, 2)
+        after = {'$or': [{'fecha': {'$lt': fecha}}, {'fecha': fecha, '_id': {'$lt': last_id}}]}
+        query = {'$and': [query, after]} if query else after
+    
+    db = mongodb.get_database()
+    collection = db[SOLICITUDES_COLLECTION]
+    projection = _solicitud_projection([*selected.values(), 'fecha']) if selected else SOLICITUD_PROJECTION
+    if expandir:
+        pipeline = [{'$match': query}, {'$sort': {'fecha': -1, '_id': -1}}]
+        if limit:
+            pipeline.append({'$limit': limit + 1})
+        pipeline += [{'$project': projection}, *_lookup_usuarios()]
+        docs = await collection.aggregate(pipeline).to_list(length=None)
+    else:
+        find = collection.find(query, projection).sort([('fecha', -1), ('_id', -1)])
+        if limit:
+            find = find.limit(limit + 1)
+        docs = await find.to_list(length=None)
+    docs, next_cursor = _next_page(docs, limit, lambda doc: (doc['fecha'], doc['_id']))
+    
+    docs = [_solicitud_compacta(doc) for doc in docs]
+    if selected:
+        return [_pick_fields(doc, selected) for doc in docs], next_cursor
+    return docs, next_cursor
+
+def _fin_de_rango(fecha_hasta: str) -> dict:
+    # Una fecha sin hora incluye todo ese día: '2025-06-05T10:00' > '2025-06-05'
+    if len(fecha_hasta) == 10:
+        siguiente = date.fromisoformat(fecha_hasta) + timedelta(days=1)
+        return {'$lt': siguiente.isoformat()}
+    datetime.fromisoformat(fecha_hasta)
+    return {'$lte': fecha_hasta}
+
+@medir('data')
+async def get_solicitudes(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    expandir: bool = False
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Obtener solicitudes ordenadas por fecha descendente, paginadas por (fecha, _id)
+
+    Los usuarios vienen como referencia {id, correo, nombre}; con expandir se
+    completan con los datos actuales (incluido el rol) desde Usuarios mediante $lookup.
+    """
     try:
-        db = mongodb.get_database()
-        collection = db[SOLICITUDES_COLLECTION]
-        docs = list(collection.find({}).sort('fecha', -1))
-        return [from_mongodb_solicitud(doc) for doc in docs]
+        return await _find_solicitudes({}, limit, cursor, fields, expandir)
+    except ValueError:
+        raise
     except Exception as error:
         print(f"Error fetching solicitudes: {error}")
         raise error
 
-async def get_solicitud_by_id(id: str) -> Optional[Solicitudes]:
-    """Obtener una solicitud por ID"""
+@medir('data')
+async def buscar_solicitudes(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    estado: Optional[str] = None,
+    empleado_correo: Optional[str] = None,
+    supervisor_correo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    texto: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    expandir: bool = False
+) -> Tuple[List[dict], Optional[str]]:
+    """Buscar solicitudes por rango de fechas, estado, usuarios, categoría y texto"""
+    query = {}
+    rango = {}
+    if fecha_desde:
+        datetime.fromisoformat(fecha_desde)
+        rango['$gte'] = fecha_desde
+    if fecha_hasta:
+        rango.update(_fin_de_rango(fecha_hasta))
+    if rango:
+        query['fecha'] = rango
+    if estado:
+        query['estado'] = estado
+    if empleado_correo:
+        query['empleado.correo'] = empleado_correo
+    if supervisor_correo:
+        query['supervisor.correo'] = supervisor_correo
+    if categoria:
+        query['categoria'] = categoria
+    if texto:
+        # Usa el índice de texto sobre titulo y descripcion
+        query['$text'] = {'$search': texto}
+    
+    try:
+        return await _find_solicitudes(query, limit, cursor, fields, expandir)
+    except ValueError:
+        raise
+    except Exception as error:
+        print(f"Error searching solicitudes: {error}")
+        raise error
+
+@medir('data')
+async def get_solicitud_by_id(id: str) -> Optional[dict]:
+    """Obtener una solicitud por ID, con sus usuarios expandidos"""
     if not id:
         return None
     
     try:
         db = mongodb.get_database()
         collection = db[SOLICITUDES_COLLECTION]
-        doc = collection.find_one({'_id': ObjectId(id)})
+        pipeline = [{'$match': {'_id': ObjectId(id)}}, {'$project': SOLICITUD_PROJECTION}, *_lookup_usuarios()]
+        docs = await collection.aggregate(pipeline).to_list(length=1)
         
-        if doc:
-            return from_mongodb_solicitud(doc)
+        if docs:
+            return _solicitud_compacta(docs[0])
         return None
     except InvalidId:
         print(f"ID inválido: {id}")
@@ -79,48 +313,33 @@ async def get_solicitud_by_id(id: str) -> Optional[Solicitudes]:
         print(f"Error fetching solicitud by ID: {error}")
         return None
 
-async def add_solicitud(solicitud_data: SolicitudCreate) -> Solicitudes:
-    """Agregar una nueva solicitud"""
+async def _referencia_usuario(usuario: UsuarioSolicitud) -> dict:
+    # Usuarios registrados se guardan por referencia; el correo se conserva
+    # porque buscar_solicitudes filtra por él con índice, y el nombre porque
+    # los listados lo muestran sin expandir
+    registrado = await get_usuario_by_correo(usuario.correo)
+    if registrado is None:
+        return usuario.model_dump(mode='json')
+    return {'id': ObjectId(registrado.id), 'correo': registrado.correo, 'nombre': registrado.nombre}
+
+@medir('data')
+async def add_solicitud(solicitud_data: SolicitudCreate) -> dict:
+    """Agregar una nueva solicitud con referencias a sus usuarios"""
     try:
         db = mongodb.get_database()
         collection = db[SOLICITUDES_COLLECTION]
         
-        # Convertir a diccionario para insertar
-        solicitud_dict = solicitud_data.dict()
-        
-        result = collection.insert_one(solicitud_dict)
+        solicitud_dict = solicitud_data.model_dump(mode='json', exclude=set(SOLICITUD_USUARIOS))
+        for rol in SOLICITUD_USUARIOS:
+            solicitud_dict[rol] = await _referencia_usuario(getattr(solicitud_data, rol))
         
-        # Construir el objeto Solicitudes convirtiendo UsuarioSolicitud a Usuario
-        return Solicitudes(
-            id=str(result.inserted_id),
-            titulo=solicitud_dict['titulo'],
-            categoria=solicitud_dict['categoria'],
-            descripcion=solicitud_dict['descripcion'],
-            fecha=solicitud_dict['fecha'],
-            empleado=Usuario(
-                nombre=solicitud_dict['empleado']['nombre'],
-                correo=solicitud_dict['empleado']['correo'],
-                rol=solicitud_dict['empleado']['rol'],
-                contraseña=""  # Contraseña vacía por defecto
-            ),
-            supervisor=Usuario(
-                nombre=solicitud_dict['supervisor']['nombre'],
-                correo=solicitud_dict['supervisor']['correo'],
-                rol=solicitud_dict['supervisor']['rol'],
-                contraseña=""  # Contraseña vacía por defecto
-            ),
-            hr=Usuario(
-                nombre=solicitud_dict['hr']['nombre'],
-                correo=solicitud_dict['hr']['correo'],
-                rol=solicitud_dict['hr']['rol'],
-                contraseña=""  # Contraseña vacía por defecto
-            ),
-            documentoId=solicitud_dict['documentoId']
-        )
+        await collection.insert_one(solicitud_dict)
+        return _solicitud_compacta(solicitud_dict)
     except Exception as error:
         print(f"Error adding solicitud: {error}")
         raise error
 
+@medir('data')
 async def delete_solicitud(id: str) -> bool:
     """Eliminar una solicitud por ID"""
     if not id:
@@ -129,7 +348,7 @@ async def delete_solicitud(id: str) -> bool:
     try:
         db = mongodb.get_database()
         collection = db[SOLICITUDES_COLLECTION]
-        result = collection.delete_one({'_id': ObjectId(id)})
+        result = await collection.delete_one({'_id': ObjectId(id)})
         return result.deleted_count == 1
     except InvalidId:
         print(f"ID inválido: {id}")
@@ -139,29 +358,55 @@ async def delete_solicitud(id: str) -> bool:
         return False
 
 # Métodos para Usuarios
-async def get_usuarios() -> List[UsuarioWithId]:
-    """Obtener todos los usuarios"""
+@medir('data')
+async def get_usuarios(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Union[UsuarioWithId, dict]], Optional[str]]:
+    """Obtener usuarios ordenados por _id, paginados por cursor"""
+    selected = select_fields(fields, USUARIO_FIELDS)
+    query = {}
+    if cursor:
+        last_id, = decode_cursor(cursor, 1)
+        query = {'_id': {'$gt': last_id}}
+    
     try:
         db = mongodb.get_database()
         collection = db[USUARIOS_COLLECTION]
-        docs = list(collection.find({}))
-        return [from_mongodb_usuario(doc) for doc in docs]
+        projection = _mongo_projection(selected.values()) if selected else None
+        find = collection.find(query, projection).sort('_id', 1)
+        if limit:
+            find = find.limit(limit + 1)
+        docs = await find.to_list(length=None)
+        docs, next_cursor = _next_page(docs, limit, lambda doc: (doc['_id'],))
+        
+        if selected:
+            return [_pick_fields(doc, selected) for doc in docs], next_cursor
+        return [from_mongodb_usuario(doc) for doc in docs], next_cursor
     except Exception as error:
         print(f"Error fetching usuarios: {error}")
         raise error
 
+@medir('data')
 async def get_usuario_by_id(id: str) -> Optional[UsuarioWithId]:
     """Obtener un usuario por ID"""
     if not id:
         return None
     
+    cached = usuarios_cache.get(('id', id))
+    if cached is not None:
+        return cached
+    
     try:
         db = mongodb.get_database()
         collection = db[USUARIOS_COLLECTION]
-        doc = collection.find_one({'_id': ObjectId(id)})
+        doc = await collection.find_one({'_id': ObjectId(id)})
         
         if doc:
-            return from_mongodb_usuario(doc)
+            usuario = from_mongodb_usuario(doc)
+            _cachear_usuario(usuario)
+            return usuario
         return None
     except InvalidId:
         print(f"ID inválido: {id}")
@@ -170,6 +415,7 @@ async def get_usuario_by_id(id: str) -> Optional[UsuarioWithId]:
         print(f"Error fetching usuario by ID: {error}")
         return None
 
+@medir('data')
 async def add_usuario(usuario_data: Usuario) -> UsuarioWithId:
     """Agregar un nuevo usuario"""
     try:
@@ -179,7 +425,8 @@ async def add_usuario(usuario_data: Usuario) -> UsuarioWithId:
         # Convertir a diccionario para insertar
         usuario_dict = usuario_data.dict()
         
-        result = collection.insert_one(usuario_dict)
+        result = await collection.insert_one(usuario_dict)
+        _invalidar_usuario(str(result.inserted_id), usuario_dict['correo'])
         
         return UsuarioWithId(
             id=str(result.inserted_id),
@@ -189,6 +436,67 @@ async def add_usuario(usuario_data: Usuario) -> UsuarioWithId:
         print(f"Error adding usuario: {error}")
         raise error
 
+# Filas validadas por cada insert_many de la carga masiva
+USUARIOS_LOTE = int(os.getenv('USUARIOS_LOTE', 1000))
+DUPLICATE_KEY = 11000
+
+def _error_validacion(error: ValidationError) -> str:
+    return '; '.join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+
+async def _insertar_usuarios(lote: List[Tuple[int, dict]], errores: List[ErrorFilaUsuario]) -> int:
+    collection = mongodb.get_database()[USUARIOS_COLLECTION]
+    docs = [doc for _, doc in lote]
+    try:
+        result = await collection.insert_many(docs, ordered=False)
+        insertados = len(result.inserted_ids)
+    except BulkWriteError as error:
+        # Sin orden, Mongo inserta todo lo válido y reporta cada fila fallida por índice
+        insertados = error.details.get('nInserted', 0)
+        for write_error in error.details.get('writeErrors', []):
+            fila, doc = lote[write_error['index']]
+            mensaje = 'correo duplicado' if write_error.get('code') == DUPLICATE_KEY else write_error.get('errmsg', 'error')
+            errores.append(ErrorFilaUsuario(fila=fila, correo=doc.get('correo'), error=mensaje))
+    for doc in docs:
+        _invalidar_usuario(str(doc['_id']), doc['correo'])
+    return insertados
+
+@medir('data')
+async def add_usuarios(filas: AsyncIterator[Tuple[int, Union[dict, Exception]]]) -> ResultadoLoteUsuarios:
+    """
+    Agregar usuarios en lotes de USUARIOS_LOTE con insert_many sin orden
+
+    Args:
+        filas: (número de fila, datos) en el orden de la entrada; un Exception
+            en lugar de los datos indica una fila que no se pudo leer
+
+    Returns:
+        Cantidad insertada y el error de cada fila rechazada
+    """
+    errores: List[ErrorFilaUsuario] = []
+    insertados = 0
+    lote: List[Tuple[int, dict]] = []
+    
+    async for fila, datos in filas:
+        if isinstance(datos, Exception):
+            errores.append(ErrorFilaUsuario(fila=fila, error=str(datos)))
+            continue
+        try:
+            usuario = Usuario.model_validate(datos)
+        except ValidationError as error:
+            correo = datos.get('correo') if isinstance(datos, dict) else None
+            errores.append(ErrorFilaUsuario(fila=fila, correo=correo if isinstance(correo, str) else None, error=_error_validacion(error)))
+            continue
+        lote.append((fila, usuario.model_dump(mode='json')))
+        if len(lote) >= USUARIOS_LOTE:
+            insertados += await _insertar_usuarios(lote, errores)
+            lote = []
+    if lote:
+        insertados += await _insertar_usuarios(lote, errores)
+    
+    errores.sort(key=lambda error: error.fila)
+    return ResultadoLoteUsuarios(insertados=insertados, errores=errores)
+
+@medir('data')
 async def delete_usuario(id: str) -> bool:
     """Eliminar un usuario por ID"""
     if not id:
@@ -197,8 +505,10 @@ async def delete_usuario(id: str) -> bool:
     try:
         db = mongodb.get_database()
         collection = db[USUARIOS_COLLECTION]
-        result = collection.delete_one({'_id': ObjectId(id)})
-        return result.deleted_count == 1
+        # find_one_and_delete devuelve el correo para invalidar también esa entrada
+        doc = await collection.find_one_and_delete({'_id': ObjectId(id)}, {'correo': 1})
+        _invalidar_usuario(id, doc.get('correo') if doc else None)
+        return doc is not None
     except InvalidId:
         print(f"ID inválido: {id}")
         return False
@@ -207,23 +517,31 @@ async def delete_usuario(id: str) -> bool:
         return False
 
 # Métodos adicionales que podrían ser útiles
+@medir('data')
 async def get_usuario_by_correo(correo: str) -> Optional[UsuarioWithId]:
     """Obtener un usuario por correo electrónico"""
     if not correo:
         return None
     
+    cached = usuarios_cache.get(('correo', correo))
+    if cached is not None:
+        return cached
+    
     try:
         db = mongodb.get_database()
         collection = db[USUARIOS_COLLECTION]
-        doc = collection.find_one({'correo': correo})
+        doc = await collection.find_one({'correo': correo})
         
         if doc:
-            return from_mongodb_usuario(doc)
+            usuario = from_mongodb_usuario(doc)
+            _cachear_usuario(usuario)
+            return usuario
         return None
     except Exception as error:
         print(f"Error fetching usuario by correo: {error}")
         return None
 
+@medir('data')
 async def update_solicitud(id: str, update_data: dict) -> bool:
     """Actualizar una solicitud"""
     if not id:
@@ -232,7 +550,7 @@ async def update_solicitud(id: str, update_data: dict) -> bool:
     try:
         db = mongodb.get_database()
         collection = db[SOLICITUDES_COLLECTION]
-        result = collection.update_one(
+        result = await collection.update_one(
             {'_id': ObjectId(id)},
             {'$set': update_data}
         )
@@ -246,7 +564,11 @@ async def update_solicitud(id: str, update_data: dict) -> bool:
 
 #Metodos para ingresar Documentos
 
-async def upload_documento(file_data: bytes, documento_info: DocumentoUpload) -> str:
+@medir('data')
+async def upload_documento(
+    file_data: Union[bytes, AsyncIterator[bytes], Callable[[], AsyncIterator[bytes]]],
+    documento_info: DocumentoUpload
+) -> str:
     """Subir un documento a GridFS"""
     try:
         # Preparar metadatos
@@ -278,10 +600,11 @@ async def upload_documento(file_data: bytes, documento_info: DocumentoUpload) ->
         print(f"Error uploading documento: {error}")
         raise error
 
+@medir('data')
 async def get_documento_by_id(documento_id: str) -> Optional[DocumentoFirmado]:
-    """Obtener un documento por ID"""
+    """Obtener un documento por ID (solo metadatos, sin leer el contenido)"""
     try:
-        file_data = await gridfs.download_file(documento_id)
+        file_data = await gridfs.get_file_info(documento_id)
         if file_data:
             return from_gridfs_documento(file_data)
         return None
@@ -289,18 +612,24 @@ async def get_documento_by_id(documento_id: str) -> Optional[DocumentoFirmado]:
         print(f"Error fetching documento: {error}")
         return None
 
-async def download_documento(documento_id: str) -> Optional[dict]:
-    """Descargar un documento completo con sus datos"""
+@medir('data')
+async def open_documento_stream(documento_id: str):
+    """Abrir un documento para descarga por streaming, sin leer sus datos"""
     try:
-        return await gridfs.download_file(documento_id)
+        return await gridfs.open_download_stream(documento_id)
     except Exception as error:
-        print(f"Error downloading documento: {error}")
+        print(f"Error opening documento: {error}")
         return None
 
+def stream_documento(file_doc, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Iterar los bytes [start, end] de un documento abierto, chunk por chunk"""
+    return gridfs.stream_file(file_doc, start, end)
+
+@medir('data')
 async def get_documentos_by_solicitud(solicitud_id: str) -> List[DocumentoFirmado]:
     """Obtener todos los documentos de una solicitud"""
     try:
-        filter_metadata = {'solicitud_id': solicitud_id}
+        filter_metadata = {'solicitud_id': solicitud_id, **SIN_VERSIONES_FIRMADAS}
         files = await gridfs.list_files(filter_metadata)
         
         return [from_gridfs_documento(file_data) for file_data in files]
@@ -308,37 +637,246 @@ async def get_documentos_by_solicitud(solicitud_id: str) -> List[DocumentoFirmad
         print(f"Error fetching documentos by solicitud: {error}")
         return []
 
+@medir('data')
 async def firmar_documento(firma_data: FirmaDocumento) -> bool:
-    """Firmar un documento"""
+    """Firmar un documento de forma atómica; falla si ya estaba firmado"""
     try:
-        # Obtener metadatos actuales
-        file_data = await gridfs.download_file(firma_data.documento_id)
-        if not file_data:
-            return False
-        
-        # Actualizar metadatos con información de firma
-        new_metadata = file_data['metadata'].copy()
-        new_metadata.update({
+        # Metadatos adicionales de firma primero, para que no pisen los campos de estado
+        fields = dict(firma_data.metadata_firma or {})
+        fields.update({
             'firmado': True,
             'firmado_por': firma_data.firmado_por,
             'fecha_firma': firma_data.fecha_firma,
             'estado': 'firmado'
         })
         
-        # Agregar metadatos adicionales de firma si los hay
-        if firma_data.metadata_firma:
-            new_metadata.update(firma_data.metadata_firma)
-        
-        # Actualizar metadatos
-        return await gridfs.update_file_metadata(
-            firma_data.documento_id, 
-            new_metadata
+        # Un solo find-and-modify condicionado a firmado: false
+        file_data = await gridfs.update_metadata_fields(
+            firma_data.documento_id,
+            fields,
+            condition={'firmado': False}
         )
+        return file_data is not None
         
     except Exception as error:
         print(f"Error firmando documento: {error}")
         return False
 
+async def _leer_documento(documento_id: str) -> Optional[Tuple[dict, bytes]]:
+    """Leer un documento de GridFS chunk por chunk; devuelve (info, bytes)"""
+    file_doc = await gridfs.open_download_stream(documento_id)
+    if not file_doc:
+        return None
+    chunks = [chunk async for chunk in gridfs.stream_file(file_doc)]
+    return file_doc, b''.join(chunks)
+
+@medir('data')
+async def read_documento(documento_id: str) -> Optional[Tuple[str, bytes]]:
+    """Leer un documento completo desde GridFS; devuelve (filename, bytes)"""
+    try:
+        leido = await _leer_documento(documento_id)
+        if leido is None:
+            return None
+        file_doc, data = leido
+        return file_doc.filename, data
+    except Exception as error:
+        print(f"Error reading documento: {error}")
+        return None
+
+@medir('data')
+async def firmar_documento_pdf(documento_id: str, firma: FirmaPdfDocumento) -> Optional[str]:
+    """
+    Estampar la página de firma sobre un documento guardado, guardar la versión
+    firmada en GridFS y marcar el original como firmado
+
+    La solicitud pasa a apuntar a la versión firmada, que no aparece en los
+    listados de documentos para no contarla dos veces.
+
+    Returns:
+        ID de la versión firmada, o None si no existe o ya estaba firmado
+    """
+    leido = await _leer_documento(documento_id)
+    if leido is None:
+        return None
+    file_doc, original_pdf = leido
+    metadata = file_doc.metadata or {}
+    if metadata.get('firmado'):
+        return None
+    
+    fecha_firma = firma.fecha_firma or datetime.utcnow()
+    es_incremental, signed_pdf = await pdf_pool.firmar(
+        original_pdf, firma.nombre, firma.rut, firma.correo, firma.incremental,
+        fecha_firma.strftime('%d-%m-%Y')
+    )
+    
+    # La copia firmada tiene otro contenido: no hereda la verificación del original
+    metadata_copia = {k: v for k, v in metadata.items() if k not in ('verificado_en', 'hash_valido')}
+    
+    async def contenido():
+        # En modo incremental la versión firmada es el original más la actualización
+        if es_incremental:
+            yield original_pdf
+        yield signed_pdf
+    
+    campos_firma = {
+        'firmado': True,
+        'firmado_por': firma.firmado_por or firma.correo,
+        'fecha_firma': fecha_firma,
+        'estado': 'firmado'
+    }
+    try:
+        firmado_id = await gridfs.upload_file(
+            contenido(),
+            filename=f"firmado_{file_doc.filename}",
+            metadata={
+                **metadata_copia, **campos_firma,
+                'tipo': TIPO_VERSION_FIRMADA,
+                'content_type': 'application/pdf',
+                'original_id': documento_id
+            }
+        )
+        
+        # Un solo update condicionado: si otro firmante ganó, se descarta la copia
+        actualizado = await gridfs.update_metadata_fields(
+            documento_id,
+            {**campos_firma, 'firmado_id': firmado_id},
+            condition={'firmado': False}
+        )
+        if actualizado is None:
+            await gridfs.delete_file(firmado_id)
+            return None
+        
+        # Solo si la solicitud sigue apuntando a este documento y no a uno subido después
+        solicitud_id = metadata.get('solicitud_id')
+        if solicitud_id and ObjectId.is_valid(solicitud_id):
+            db = mongodb.get_database()
+            await db[SOLICITUDES_COLLECTION].update_one(
+                {'_id': ObjectId(solicitud_id), 'documentoId': documento_id},
+                {'$set': {'documentoId': firmado_id}}
+            )
+        return firmado_id
+    except Exception as error:
+        print(f"Error firmando PDF del documento: {error}")
+        raise error
+
+@medir('data')
+async def firmar_documentos(firmas: List[FirmaDocumento]) -> List[ResultadoFirma]:
+    """Firmar varios documentos con un solo bulk_write, devolviendo el resultado de cada uno"""
+    # Marca para reconocer qué documentos firmó este lote y no otro
+    lote_id = str(ObjectId())
+    resultados = []
+    updates = []
+    vistos = set()
+    
+    for firma in firmas:
+        try:
+            file_id = ObjectId(firma.documento_id)
+        except InvalidId:
+            resultados.append(ResultadoFirma(documento_id=firma.documento_id, firmado=False, error="ID inválido"))
+            continue
+        if file_id in vistos:
+            resultados.append(ResultadoFirma(documento_id=firma.documento_id, firmado=False, error="Documento repetido en el lote"))
+            continue
+        vistos.add(file_id)
+        
+        fields = dict(firma.metadata_firma or {})
+        fields.update({
+            'firmado': True,
+            'firmado_por': firma.firmado_por,
+            'fecha_firma': firma.fecha_firma,
+            'estado': 'firmado',
+            'firma_lote': lote_id
+        })
+        updates.append((file_id, fields))
+        resultados.append(None)
+    
+    try:
+        await gridfs.bulk_update_metadata_fields(updates, condition={'firmado': False})
+        
+        # Leer solo el estado de firma de los documentos del lote
+        db = mongodb.get_database()
+        cursor = db['fs.files'].find(
+            {'_id': {'$in': [file_id for file_id, _ in updates]}},
+            {'metadata.firma_lote': 1}
+        )
+        estados = {doc['_id']: (doc.get('metadata') or {}).get('firma_lote') async for doc in cursor}
+    except Exception as error:
+        print(f"Error firmando documentos en lote: {error}")
+        raise error
+    
+    pendientes = iter(updates)
+    for i, resultado in enumerate(resultados):
+        if resultado is not None:
+            continue
+        file_id, _ = next(pendientes)
+        if file_id not in estados:
+            resultados[i] = ResultadoFirma(documento_id=str(file_id), firmado=False, error="Documento no encontrado")
+        elif estados[file_id] != lote_id:
+            resultados[i] = ResultadoFirma(documento_id=str(file_id), firmado=False, error="El documento ya fue firmado")
+        else:
+            resultados[i] = ResultadoFirma(documento_id=str(file_id), firmado=True)
+    
+    return resultados
+
+# Segundos durante los que se confía en la última verificación de un documento
+VERIFICACION_TTL = int(os.getenv('VERIFICACION_TTL', 3600))
+
+@medir('data')
+async def verificar_documento(documento_id: str, usar_cache: bool = False) -> Optional[VerificacionDocumento]:
+    """
+    Verificar la integridad de un documento contra el SHA-256 guardado al subirlo
+
+    El contenido se vuelve a hashear en el servidor leyendo los chunks; con
+    usar_cache se reutiliza el resultado si la última verificación tiene menos
+    de VERIFICACION_TTL segundos. Los documentos anteriores al registro de
+    hashes guardan el digest calculado en su primera verificación.
+    """
+    file_doc = await gridfs.open_download_stream(documento_id)
+    if not file_doc:
+        return None
+    metadata = file_doc.metadata or {}
+    sha256 = metadata.get('sha256')
+    
+    verificado_en = metadata.get('verificado_en')
+    if (usar_cache and sha256 and verificado_en is not None
+            and datetime.utcnow() - verificado_en < timedelta(seconds=VERIFICACION_TTL)):
+        valido = bool(metadata.get('hash_valido'))
+        return VerificacionDocumento(
+            documento_id=documento_id,
+            sha256=sha256,
+            valido=valido,
+            verificado_en=verificado_en,
+            en_cache=True,
+            mensaje="Hash válido" if valido else "Hash inválido"
+        )
+    
+    try:
+        calculado = await gridfs.hash_file(file_doc)
+    except Exception as error:
+        # Chunks o blob faltantes o corruptos (CorruptGridFile, zlib.error, OSError...):
+        # es justo lo que la verificación debe informar, no un error del servidor
+        print(f"Error leyendo documento {documento_id} para verificarlo: {error}")
+        calculado = None
+    verificado_en = datetime.utcnow()
+    if sha256 is None and calculado is not None:
+        sha256 = calculado
+        await gridfs.update_metadata_fields(documento_id, {'sha256': calculado}, condition={'sha256': None})
+    valido = calculado is not None and calculado == sha256
+    await gridfs.update_metadata_fields(documento_id, {'verificado_en': verificado_en, 'hash_valido': valido})
+    
+    if calculado is None:
+        mensaje = "Hash inválido: no se pudo leer el contenido"
+    else:
+        mensaje = "Hash válido" if valido else "Hash inválido"
+    return VerificacionDocumento(
+        documento_id=documento_id,
+        sha256=sha256 or '',
+        valido=valido,
+        verificado_en=verificado_en,
+        mensaje=mensaje
+    )
+
+@medir('data')
 async def delete_documento(documento_id: str) -> bool:
     """Eliminar un documento"""
     try:
@@ -347,24 +885,110 @@ async def delete_documento(documento_id: str) -> bool:
         print(f"Error deleting documento: {error}")
         return False
 
-async def get_documentos_firmados() -> List[DocumentoFirmado]:
-    """Obtener todos los documentos firmados"""
+async def _find_documentos(
+    filter_metadata: Dict[str, Any],
+    filters: Optional[Dict[str, Any]],
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[List[str]]
+) -> Tuple[List[Union[DocumentoFirmado, dict]], Optional[str]]:
+    selected = select_fields(fields, DOCUMENTO_FIELDS)
+    after_id = decode_cursor(cursor, 1)[0] if cursor else None
+    
+    files = await gridfs.list_files(
+        {**filter_metadata, **SIN_VERSIONES_FIRMADAS},
+        limit=limit + 1 if limit else None,
+        after_id=after_id,
+        fields=list(_mongo_projection(selected.values())) if selected else None,
+        filters=filters
+    )
+    files, next_cursor = _next_page(files, limit, lambda file_data: (file_data['id'],))
+    
+    if selected:
+        return [_pick_fields(file_data, selected) for file_data in files], next_cursor
+    return [from_gridfs_documento(file_data) for file_data in files], next_cursor
+
+async def _get_documentos_page(
+    firmado: bool,
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[List[str]]
+) -> Tuple[List[Union[DocumentoFirmado, dict]], Optional[str]]:
+    return await _find_documentos({'firmado': firmado}, None, limit, cursor, fields)
+
+@medir('data')
+async def buscar_documentos(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    firmado: Optional[bool] = None,
+    estado: Optional[str] = None,
+    solicitud_id: Optional[str] = None,
+    firmado_por: Optional[str] = None,
+    filename: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Union[DocumentoFirmado, dict]], Optional[str]]:
+    """Buscar documentos por fecha de subida, estado de firma, solicitud, firmante y nombre"""
+    filter_metadata = {}
+    if firmado is not None:
+        filter_metadata['firmado'] = firmado
+    if estado:
+        filter_metadata['estado'] = estado
+    if solicitud_id:
+        filter_metadata['solicitud_id'] = solicitud_id
+    if firmado_por:
+        filter_metadata['firmado_por'] = firmado_por
+    
+    filters = {}
+    rango = {}
+    if fecha_desde:
+        rango['$gte'] = datetime.fromisoformat(fecha_desde)
+    if fecha_hasta:
+        if len(fecha_hasta) == 10:
+            rango['$lt'] = datetime.fromisoformat(fecha_hasta) + timedelta(days=1)
+        else:
+            rango['$lte'] = datetime.fromisoformat(fecha_hasta)
+    if rango:
+        filters['uploadDate'] = rango
+    if filename:
+        # Prefijo anclado: puede usar el índice filename_1_uploadDate_1
+        filters['filename'] = {'$regex': f'^{re.escape(filename)}'}
+    
     try:
-        filter_metadata = {'firmado': True}
-        files = await gridfs.list_files(filter_metadata)
-        
-        return [from_gridfs_documento(file_data) for file_data in files]
+        return await _find_documentos(filter_metadata, filters, limit, cursor, fields)
+    except ValueError:
+        raise
+    except Exception as error:
+        print(f"Error searching documentos: {error}")
+        return [], None
+
+@medir('data')
+async def get_documentos_firmados(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Union[DocumentoFirmado, dict]], Optional[str]]:
+    """Obtener documentos firmados, paginados por cursor"""
+    try:
+        return await _get_documentos_page(True, limit, cursor, fields)
+    except ValueError:
+        raise
     except Exception as error:
         print(f"Error fetching documentos firmados: {error}")
-        return []
+        return [], None
 
-async def get_documentos_pendientes() -> List[DocumentoFirmado]:
-    """Obtener todos los documentos pendientes de firma"""
+@medir('data')
+async def get_documentos_pendientes(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Union[DocumentoFirmado, dict]], Optional[str]]:
+    """Obtener documentos pendientes de firma, paginados por cursor"""
     try:
-        filter_metadata = {'firmado': False}
-        files = await gridfs.list_files(filter_metadata)
-        
-        return [from_gridfs_documento(file_data) for file_data in files]
+        return await _get_documentos_page(False, limit, cursor, fields)
+    except ValueError:
+        raise
     except Exception as error:
         print(f"Error fetching documentos pendientes: {error}")
-        return []
\ No newline at end of file
+        return [], None
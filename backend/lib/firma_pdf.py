@@ -0,0 +1,520 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import struct
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject, PdfObject, StreamObject
+)
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from .metricas import FIRMA_PDF
+
+class ColaPdfLlena(Exception):
+    """No hay espacio en la cola del pool de firma de PDFs"""
+
+# Posiciones de la página de firma: texto fijo y etiquetas de cada campo variable
+LAYOUTS = {
+    'simple': {
+        'fuente': ("Helvetica", 12),
+        'titulo': (100, 700, "FIRMA ELECTRÓNICA SIMPLE"),
+        'campos': [
+            ('nombre', "Nombre: ", 100, 670),
+            ('rut', "RUT: ", 100, 650),
+            ('correo', "Correo: ", 100, 630),
+            ('fecha', "Fecha de firma: ", 100, 610),
+        ],
+    },
+}
+OVERLAY_CACHE_SIZE = int(os.getenv('PDF_OVERLAY_CACHE_SIZE', 256))
+
+@lru_cache(maxsize=None)
+def _plantilla_firma(layout: str, pagesize: Tuple[float, float]):
+    """
+    Renderizar una sola vez (por proceso) la parte fija de la página de firma
+
+    Returns:
+        (PageObject de la plantilla, nombre del recurso de fuente en la página)
+    """
+    config = LAYOUTS[layout]
+    fuente, tamano = config['fuente']
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=pagesize)
+    can.setFont(fuente, tamano)
+    x, y, titulo = config['titulo']
+    can.drawString(x, y, titulo)
+    for _, etiqueta, x, y in config['campos']:
+        can.drawString(x, y, etiqueta)
+    can.save()
+    packet.seek(0)
+    page = PdfReader(packet).pages[0]
+
+    fuentes = page["/Resources"]["/Font"]
+    recurso = next(name for name, font in fuentes.items() if font.get_object()["/BaseFont"] == f"/{fuente}")
+    return page, recurso
+
+def _texto_pdf(texto: str) -> bytes:
+    # Helvetica de reportlab usa WinAnsiEncoding (cp1252)
+    data = texto.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+@lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def _overlay_firma(layout: str, pagesize: Tuple[float, float], nombre: str, rut: str, correo: str, fecha: str) -> bytes:
+    """Content stream con los datos del firmante, escrito a continuación de cada etiqueta"""
+    config = LAYOUTS[layout]
+    fuente, tamano = config['fuente']
+    _, recurso = _plantilla_firma(layout, pagesize)
+    valores = {'nombre': nombre, 'rut': rut, 'correo': correo, 'fecha': fecha}
+
+    partes = []
+    for campo, etiqueta, x, y in config['campos']:
+        x += stringWidth(etiqueta, fuente, tamano)
+        partes.append(
+            b"BT %s %d Tf 1 0 0 1 %.2f %d Tm (%s) Tj ET" % (recurso.encode(), tamano, x, y, _texto_pdf(valores[campo]))
+        )
+    return b"\n".join(partes) + b"\n"
+
+def _pagina_firma(
+    nombre: str,
+    rut: str,
+    correo: str,
+    fecha: Optional[str] = None,
+    layout: str = 'simple',
+    pagesize: Tuple[float, float] = letter
+):
+    """
+    Página de firma: plantilla cacheada más el overlay con los datos del firmante
+
+    Returns:
+        (PageObject de la plantilla, DecodedStreamObject del overlay); el overlay
+        se agrega a /Contents después de copiar la página al PDF de destino
+    """
+    page, _ = _plantilla_firma(layout, tuple(pagesize))
+    overlay = DecodedStreamObject()
+    overlay._data = _overlay_firma(layout, tuple(pagesize), nombre, rut, correo, fecha or date.today().strftime("%d-%m-%Y"))
+    return page, overlay
+
+def _agregar_contenido(page: DictionaryObject, ref: IndirectObject) -> None:
+    contenidos = page.raw_get("/Contents")
+    if isinstance(contenidos, ArrayObject):
+        contenidos = list(contenidos)
+    else:
+        contenidos = [contenidos]
+    page[NameObject("/Contents")] = ArrayObject(contenidos + [ref])
+
+def firmar_pdf_bytes(original_pdf: bytes, nombre: str, rut: str, correo: str, fecha: Optional[str] = None) -> bytes:
+    """
+    Agregar una página de firma al final de un PDF reescribiendo el archivo completo
+
+    Se ejecuta en un proceso del pool, por eso recibe y devuelve bytes.
+    """
+    reader = PdfReader(io.BytesIO(original_pdf))
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+
+    plantilla, overlay = _pagina_firma(nombre, rut, correo, fecha)
+    page = writer.add_page(plantilla)
+    _agregar_contenido(page, writer._add_object(overlay))
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def _serializar(obj: PdfObject) -> bytes:
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+def _leer_startxref(pdf: bytes) -> int:
+    pos = pdf.rfind(b"startxref")
+    if pos < 0:
+        raise ValueError("PDF sin startxref")
+    return int(pdf[pos + len(b"startxref"):].split()[0])
+
+def _subsecciones(numeros: List[int]) -> List[Tuple[int, int]]:
+    # Agrupa números de objeto consecutivos: [(inicio, cantidad), ...]
+    grupos = []
+    for numero in numeros:
+        if grupos and grupos[-1][0] + grupos[-1][1] == numero:
+            grupos[-1] = (grupos[-1][0], grupos[-1][1] + 1)
+        else:
+            grupos.append((numero, 1))
+    return grupos
+
+def _tamano(reader: PdfReader, pdf: bytes, prev: int) -> int:
+    # Con xref stream PyPDF2 no copia /Size al trailer: se toma del diccionario
+    # del último xref y del mayor número de objeto conocido
+    tamanos = [int(reader.trailer.get("/Size", 0))]
+    match = re.search(rb"/Size\s+(\d+)", pdf[prev:prev + 4096])
+    if match:
+        tamanos.append(int(match.group(1)))
+    for entradas in reader.xref.values():
+        tamanos.extend(numero + 1 for numero in entradas)
+    tamanos.extend(numero + 1 for numero in reader.xref_objStm)
+    return max(tamanos)
+
+class _Actualizacion:
+    """Objetos nuevos o reemplazados por una actualización incremental"""
+
+    def __init__(self, size: int):
+        self.siguiente = size
+        self.objetos: Dict[int, Tuple[int, PdfObject]] = {}
+        self._copiados: Dict[int, int] = {}
+
+    def reservar(self) -> int:
+        numero = self.siguiente
+        self.siguiente += 1
+        return numero
+
+    def agregar(self, obj: PdfObject) -> IndirectObject:
+        """Agregar un objeto nuevo (ya con referencias de este PDF)"""
+        numero = self.reservar()
+        self.objetos[numero] = (0, obj)
+        return IndirectObject(numero, 0, None)
+
+    def copiar(self, obj):
+        """Copiar un objeto de otro PDF, renumerando sus referencias indirectas"""
+        if isinstance(obj, IndirectObject):
+            if obj.idnum not in self._copiados:
+                numero = self.reservar()
+                self._copiados[obj.idnum] = numero
+                self.objetos[numero] = (0, self.copiar(obj.get_object()))
+            return IndirectObject(self._copiados[obj.idnum], 0, None)
+        if isinstance(obj, StreamObject):
+            copia = obj.__class__()
+            copia._data = obj._data
+            for key, value in obj.items():
+                if key != "/Length":
+                    copia[NameObject(key)] = self.copiar(value)
+            return copia
+        if isinstance(obj, DictionaryObject):
+            copia = DictionaryObject()
+            for key, value in obj.items():
+                if key != "/Parent":
+                    copia[NameObject(key)] = self.copiar(value)
+            return copia
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copiar(value) for value in obj)
+        return obj
+
+def firmar_pdf_incremental(original_pdf: bytes, nombre: str, rut: str, correo: str, fecha: Optional[str] = None) -> bytes:
+    """
+    Agregar la página de firma como actualización incremental
+
+    Returns:
+        bytes: Solo la sección a concatenar después de original_pdf; los bytes
+        originales no se modifican, así que su hash sigue siendo verificable
+    """
+    reader = PdfReader(io.BytesIO(original_pdf))
+    if reader.is_encrypted:
+        raise ValueError("PDF cifrado")
+
+    trailer = reader.trailer
+    prev = _leer_startxref(original_pdf)
+    usa_tabla = original_pdf[prev:].lstrip()[:4] == b"xref"
+    update = _Actualizacion(_tamano(reader, original_pdf, prev))
+
+    # Nueva versión del nodo /Pages con la página de firma al final
+    root = trailer["/Root"]
+    pages_ref = root.raw_get("/Pages")
+    pages = pages_ref.get_object()
+    kids = pages.raw_get("/Kids")
+    if isinstance(kids, IndirectObject):
+        kids = kids.get_object()
+
+    page_num = update.reservar()
+    plantilla, overlay = _pagina_firma(nombre, rut, correo, fecha)
+    page = update.copiar(plantilla)
+    _agregar_contenido(page, update.agregar(overlay))
+    page[NameObject("/Parent")] = IndirectObject(pages_ref.idnum, pages_ref.generation, None)
+    update.objetos[page_num] = (0, page)
+
+    new_pages = DictionaryObject()
+    for key, value in pages.items():
+        new_pages[NameObject(key)] = value
+    new_pages[NameObject("/Kids")] = ArrayObject(list(kids) + [IndirectObject(page_num, 0, None)])
+    new_pages[NameObject("/Count")] = NumberObject(int(pages["/Count"]) + 1)
+    update.objetos[pages_ref.idnum] = (pages_ref.generation, new_pages)
+
+    output = io.BytesIO()
+    if not original_pdf.endswith(b"\n"):
+        output.write(b"\n")
+
+    offsets = {}
+    for numero, (generacion, obj) in sorted(update.objetos.items()):
+        offsets[numero] = (len(original_pdf) + output.tell(), generacion)
+        output.write(f"{numero} {generacion} obj\n".encode())
+        output.write(_serializar(obj))
+        output.write(b"\nendobj\n")
+
+    xref_offset = len(original_pdf) + output.tell()
+    new_trailer = DictionaryObject()
+    new_trailer[NameObject("/Root")] = trailer.raw_get("/Root")
+    new_trailer[NameObject("/Prev")] = NumberObject(prev)
+    for key in ("/Info", "/ID"):
+        if key in trailer:
+            new_trailer[NameObject(key)] = trailer.raw_get(key)
+
+    if usa_tabla:
+        new_trailer[NameObject("/Size")] = NumberObject(update.siguiente)
+        # Se incluye la entrada 0 (cabeza de la lista de libres) como hacen los demás escritores
+        output.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+        for inicio, cantidad in _subsecciones(sorted(offsets)):
+            output.write(f"{inicio} {cantidad}\n".encode())
+            for numero in range(inicio, inicio + cantidad):
+                offset, generacion = offsets[numero]
+                output.write(f"{offset:010d} {generacion:05d} n\r\n".encode())
+        output.write(b"trailer\n")
+        output.write(_serializar(new_trailer))
+        output.write(b"\n")
+    else:
+        # El original usa xref stream: la actualización también debe usarlo
+        xref_num = update.reservar()
+        offsets[xref_num] = (xref_offset, 0)
+        numeros = sorted(offsets)
+        xref = DecodedStreamObject()
+        xref._data = b"".join(struct.pack(">BIH", 1, *offsets[numero]) for numero in numeros)
+        xref.update(new_trailer)
+        xref[NameObject("/Type")] = NameObject("/XRef")
+        xref[NameObject("/Size")] = NumberObject(update.siguiente)
+        xref[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)])
+        xref[NameObject("/Index")] = ArrayObject(
+            NumberObject(valor) for grupo in _subsecciones(numeros) for valor in grupo
+        )
+        output.write(f"{xref_num} 0 obj\n".encode())
+        output.write(_serializar(xref))
+        output.write(b"\nendobj\n")
+
+    output.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+    return output.getvalue()
+
+def firmar_pdf(
+    original_pdf: bytes,
+    nombre: str,
+    rut: str,
+    correo: str,
+    incremental: bool = True,
+    fecha: Optional[str] = None
+) -> Tuple[bool, bytes]:
+    """
+    Firmar un PDF en un proceso del pool
+
+    Returns:
+        (True, bytes a agregar al final del original) si se usó actualización
+        incremental, o (False, PDF completo) si se reescribió el archivo
+    """
+    if incremental:
+        try:
+            return True, firmar_pdf_incremental(original_pdf, nombre, rut, correo, fecha)
+        except Exception as e:
+            print(f"Firma incremental no disponible, se reescribe el PDF: {e}")
+    return False, firmar_pdf_bytes(original_pdf, nombre, rut, correo, fecha)
+
+class _SalidaZip:
+    """Destino no seekable para zipfile: acumula lo escrito hasta que se drena"""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._partes.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drenar(self) -> bytes:
+        data = b"".join(self._partes)
+        self._partes.clear()
+        return data
+
+def _nombre_entrada(filename: Optional[str], indice: int) -> str:
+    # El nombre lo manda el cliente: sin rutas para que no escriba fuera de la
+    # carpeta al descomprimir (zip slip)
+    nombre = os.path.basename((filename or "").replace("\\", "/"))
+    if nombre in ("", ".", ".."):
+        return f"documento {indice + 1}"
+    return nombre
+
+def _nombre_unico(nombre: str, usados: set) -> str:
+    base, extension = os.path.splitext(nombre)
+    candidato = nombre
+    contador = 1
+    while candidato in usados:
+        candidato = f"{base}_{contador}{extension}"
+        contador += 1
+    usados.add(candidato)
+    return candidato
+
+def _liberar_cupo(loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore):
+    # Se llama desde el hilo del executor al terminar el trabajo
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        pass  # El event loop ya se cerró (apagado del servidor)
+
+# Carga perezosa de cada PDF del lote: devuelve (nombre de archivo, bytes) o None
+CargaPdf = Callable[[], Awaitable[Optional[Tuple[str, bytes]]]]
+
+class PdfPool:
+    def __init__(self):
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.workers = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
+        self.queue_size = int(os.getenv('PDF_QUEUE_SIZE', self.workers * 4))
+        self.timeout = float(os.getenv('PDF_TIMEOUT', 30))
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        """Crear el pool de procesos para el trabajo de PDFs"""
+        if self.executor is None:
+            # forkserver: hacer fork del proceso principal copiaría los hilos de
+            # Motor en un estado inconsistente
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+            # Trabajos en ejecución más los que esperan en cola
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self._slots = None
+
+    async def run(self, func, *args, esperar: bool = False):
+        """
+        Ejecutar una función en el pool sin bloquear el event loop
+
+        El cupo se devuelve cuando el proceso termina el trabajo, no cuando vence
+        el timeout: un trabajo colgado sigue ocupando su worker y su cupo, así la
+        cola del executor nunca crece más allá de workers + queue_size.
+
+        Args:
+            esperar: esperar un cupo libre en vez de fallar de inmediato
+
+        Raises:
+            ColaPdfLlena: si ya hay workers + queue_size trabajos pendientes y no se espera
+            asyncio.TimeoutError: si el trabajo no termina en self.timeout segundos
+        """
+        if self.executor is None:
+            self.start()
+        slots = self._slots
+        if slots.locked() and not esperar:
+            raise ColaPdfLlena("Demasiadas firmas de PDF en curso")
+
+        await slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            trabajo = self.executor.submit(func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        trabajo.add_done_callback(lambda _: _liberar_cupo(loop, slots))
+        # Al vencer el timeout se cancela el trabajo si aún no empezó; si ya corre,
+        # el proceso lo termina en segundo plano y recién ahí libera el cupo
+        return await asyncio.wait_for(asyncio.wrap_future(trabajo), timeout=self.timeout)
+
+    async def firmar(
+        self,
+        original_pdf: bytes,
+        nombre: str,
+        rut: str,
+        correo: str,
+        incremental: bool = True,
+        fecha: Optional[str] = None,
+        esperar: bool = False
+    ) -> Tuple[bool, bytes]:
+        inicio = time.perf_counter()
+        modo = 'error'
+        try:
+            es_incremental, pdf = await self.run(
+                firmar_pdf, original_pdf, nombre, rut, correo, incremental, fecha, esperar=esperar
+            )
+            modo = 'incremental' if es_incremental else 'completo'
+            return es_incremental, pdf
+        finally:
+            FIRMA_PDF.observe(time.perf_counter() - inicio, modo)
+
+    async def firmar_zip(
+        self,
+        cargas: List[CargaPdf],
+        nombre: str,
+        rut: str,
+        correo: str,
+        incremental: bool = True
+    ) -> AsyncIterator[bytes]:
+        """
+        Firmar varios PDFs en paralelo y producir un ZIP a medida que terminan
+
+        Como máximo hay self.workers PDFs cargados a la vez; cada archivo se
+        escribe al ZIP y se entrega al cliente apenas termina su firma. Los
+        errores por archivo se informan en errores.txt dentro del ZIP.
+        """
+        async def firmar_una(indice: int, cargar: CargaPdf):
+            filename = f"documento {indice + 1}"
+            try:
+                cargado = await cargar()
+                if cargado is None:
+                    return filename, None, "Documento no encontrado"
+                filename, original_pdf = _nombre_entrada(cargado[0], indice), cargado[1]
+                # El lote espera cupo: un pool ocupado por otros usuarios no debe
+                # convertir sus archivos en errores
+                es_incremental, signed_pdf = await self.firmar(
+                    original_pdf, nombre, rut, correo, incremental, esperar=True
+                )
+                partes = [original_pdf, signed_pdf] if es_incremental else [signed_pdf]
+                return filename, partes, None
+            except asyncio.TimeoutError:
+                return filename, None, "La firma excedió el tiempo máximo"
+            except Exception as error:
+                return filename, None, str(error)
+
+        salida = _SalidaZip()
+        archivo_zip = zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_STORED)
+        pendientes = iter(enumerate(cargas))
+        en_curso = set()
+        usados = set()
+        errores = []
+        try:
+            while True:
+                while len(en_curso) < self.workers:
+                    siguiente = next(pendientes, None)
+                    if siguiente is None:
+                        break
+                    en_curso.add(asyncio.ensure_future(firmar_una(*siguiente)))
+                if not en_curso:
+                    break
+
+                listos, en_curso = await asyncio.wait(en_curso, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in listos:
+                    filename, partes, error = tarea.result()
+                    if error:
+                        errores.append(f"{filename}: {error}")
+                        continue
+                    with archivo_zip.open(_nombre_unico(f"firmado_{filename}", usados), "w", force_zip64=True) as destino:
+                        for parte in partes:
+                            destino.write(parte)
+                    yield salida.drenar()
+
+            if errores:
+                archivo_zip.writestr("errores.txt", "\n".join(errores))
+            archivo_zip.close()
+            yield salida.drenar()
+        finally:
+            # Si el cliente se desconecta no se siguen firmando archivos
+            for tarea in en_curso:
+                tarea.cancel()
+
+# Instancia global del pool de firma
+pdf_pool = PdfPool()
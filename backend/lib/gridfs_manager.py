@@ -1,26 +1,489 @@
+import asyncio
 import gridfs as mongo_gridfs
+import hashlib
 import io
-from typing import Optional, List, Dict, Any
+import mmap
+import os
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket, AsyncIOMotorGridOut
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Union, Tuple
 from bson import ObjectId
 from bson.errors import InvalidId
 from .mongodb import mongodb
+from .metricas import medir
+
+try:
+    import zstandard
+except ImportError:  # zstd es opcional; sin él se usa zlib
+    zstandard = None
+
+# Campos de fs.files necesarios para describir un archivo sin leer sus chunks
+FILE_INFO_PROJECTION = {'filename': 1, 'metadata': 1, 'uploadDate': 1, 'length': 1}
+
+def _file_info(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # blob_id es un ObjectId interno; como str se puede serializar en las respuestas
+    metadata = {
+        key: str(value) if isinstance(value, ObjectId) else value
+        for key, value in (doc.get('metadata') or {}).items()
+    }
+    return {
+        'id': str(doc['_id']),
+        'filename': doc.get('filename'),
+        'metadata': metadata,
+        'upload_date': doc['uploadDate'],
+        'length': doc['length'],
+        'content_type': metadata.get('content_type', 'application/octet-stream')
+    }
+
+# Bucket con el contenido deduplicado: un blob por SHA-256, con contador de referencias
+BLOBS_BUCKET = 'blobs'
+
+# Dónde se guarda el contenido nuevo: 'gridfs' o 'local' (los metadatos siempre en MongoDB)
+BLOB_STORE = os.getenv('BLOB_STORE', 'gridfs')
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', os.path.join(os.getcwd(), 'blobs'))
+LOCAL_CHUNK_SIZE = 255 * 1024
+
+# Códec para el contenido nuevo: 'zstd', 'zlib' o vacío para guardarlo sin comprimir
+GRIDFS_CODEC = os.getenv('GRIDFS_CODEC', '')
+# Si la muestra inicial no baja de esta proporción, el contenido se guarda tal cual
+GRIDFS_MIN_RATIO = float(os.getenv('GRIDFS_MIN_RATIO', 0.9))
+COMPRESSION_SAMPLE = 64 * 1024
+# Firmas de formatos que ya vienen comprimidos (zip, gzip, zstd, png, jpeg, 7z)
+COMPRESSED_MAGICS = (b'PK\x03\x04', b'\x1f\x8b', b'\x28\xb5\x2f\xfd', b'\x89PNG', b'\xff\xd8\xff', b'7z\xbc\xaf')
+
+def _elegir_codec(muestra: bytes) -> Optional[str]:
+    """Decidir el códec a partir del primer chunk; None si no vale la pena comprimir"""
+    codec = GRIDFS_CODEC
+    if codec == 'zstd' and zstandard is None:
+        codec = 'zlib'
+    if codec not in ('zstd', 'zlib') or muestra.startswith(COMPRESSED_MAGICS):
+        return None
+    muestra = muestra[:COMPRESSION_SAMPLE]
+    if len(zlib.compress(muestra, 1)) > len(muestra) * GRIDFS_MIN_RATIO:
+        return None
+    return codec
+
+# Máximo de bytes descomprimidos por llamada: mantiene la memoria de una descarga
+# acotada al tamaño de chunk aunque el contenido sea muy compresible
+DESCOMPRESION_MAX = 255 * 1024
+
+class _CompresorZstd:
+    """Compresor zstd que cierra un frame cada DESCOMPRESION_MAX bytes de entrada"""
+    
+    def __init__(self):
+        self._zstd = zstandard.ZstdCompressor()
+        self._frame = self._zstd.compressobj()
+        self._pendiente = DESCOMPRESION_MAX
+    
+    def compress(self, data: bytes) -> bytes:
+        # El descompresor de zstd no acepta un límite de salida; con frames acotados
+        # cada llamada entrega como máximo un frame (ver _Descompresor)
+        partes = []
+        while len(data) >= self._pendiente:
+            partes.append(self._frame.compress(data[:self._pendiente]))
+            partes.append(self._frame.flush())
+            data = data[self._pendiente:]
+            self._frame = self._zstd.compressobj()
+            self._pendiente = DESCOMPRESION_MAX
+        if data:
+            partes.append(self._frame.compress(data))
+            self._pendiente -= len(data)
+        return b''.join(partes)
+    
+    def flush(self) -> bytes:
+        if self._pendiente == DESCOMPRESION_MAX:
+            return b''  # El último frame ya se cerró
+        return self._frame.flush()
+
+def _compresor(codec: str):
+    if codec == 'zstd':
+        return _CompresorZstd()
+    return zlib.compressobj()
+
+class _Descompresor:
+    """Descompresión incremental que entrega como máximo DESCOMPRESION_MAX bytes por llamada"""
+    
+    def __init__(self, codec: str):
+        self.codec = codec
+        self._obj = self._nuevo()
+        # Entrada comprimida que quedó sin procesar por el límite de salida
+        self.pendiente = b''
+    
+    def _nuevo(self):
+        if self.codec == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj()
+    
+    def decompress(self, comprimido: bytes) -> bytes:
+        entrada = self.pendiente + comprimido if self.pendiente else comprimido
+        if self.codec == 'zlib':
+            datos = self._obj.decompress(entrada, DESCOMPRESION_MAX)
+            self.pendiente = self._obj.unconsumed_tail
+            return datos
+        # zstd descomprime un frame por objeto; lo que sigue al frame queda en unused_data
+        datos = self._obj.decompress(entrada)
+        self.pendiente = b''
+        if self._obj.eof:
+            self.pendiente = self._obj.unused_data
+            self._obj = self._nuevo()
+        return datos
+    
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+class EscrituraBlob(ABC):
+    """Escritura en curso del contenido de un blob"""
+    _id: ObjectId
+    chunk_size: int
+    
+    @abstractmethod
+    async def write(self, data: bytes): ...
+    
+    @abstractmethod
+    async def abort(self):
+        """Descartar lo escrito; no falla si ya se descartó"""
+    
+    @abstractmethod
+    async def close(self, metadata: Dict[str, Any]):
+        """Confirmar el contenido y registrar el blob en blobs.files con sus metadatos"""
+
+class BlobStore(ABC):
+    """Almacenamiento del contenido de los blobs; el índice y las referencias viven en blobs.files"""
+    nombre: str
+    
+    @abstractmethod
+    def open_upload_stream(self, filename: str) -> EscrituraBlob: ...
+    
+    @abstractmethod
+    async def open_download_stream(self, blob: Dict[str, Any]):
+        """Abrir el blob descrito por su documento de blobs.files (seek/readchunk/read)"""
+    
+    @abstractmethod
+    async def delete(self, blob_id: ObjectId): ...
+
+class _EscrituraGridFS(EscrituraBlob):
+    def __init__(self, grid_in):
+        self._grid_in = grid_in
+        self._id = grid_in._id
+        self.chunk_size = grid_in.chunk_size
+    
+    async def write(self, data: bytes):
+        await self._grid_in.write(data)
+    
+    async def abort(self):
+        await self._grid_in.abort()
+    
+    async def close(self, metadata: Dict[str, Any]):
+        await self._grid_in.set('metadata', metadata)
+        await self._grid_in.close()
+
+class GridFSBlobStore(BlobStore):
+    """Contenido en blobs.chunks, como cualquier archivo de GridFS"""
+    nombre = 'gridfs'
+    
+    def __init__(self, bucket: AsyncIOMotorGridFSBucket):
+        self.bucket = bucket
+    
+    def open_upload_stream(self, filename: str) -> EscrituraBlob:
+        return _EscrituraGridFS(self.bucket.open_upload_stream(filename))
+    
+    async def open_download_stream(self, blob: Dict[str, Any]):
+        # El documento ya se leyó: el GridOut no vuelve a consultar blobs.files
+        return AsyncIOMotorGridOut(mongodb.get_database()[BLOBS_BUCKET], file_document=blob)
+    
+    async def delete(self, blob_id: ObjectId):
+        await mongodb.get_database()[f'{BLOBS_BUCKET}.chunks'].delete_many({'files_id': blob_id})
+
+class _EscrituraLocal(EscrituraBlob):
+    def __init__(self, store: 'LocalBlobStore', filename: str):
+        self._id = ObjectId()
+        self.chunk_size = LOCAL_CHUNK_SIZE
+        self.filename = filename
+        self.path = store.ruta(self._id)
+        self._tmp = f'{self.path}.tmp'
+        self._file = None
+        self._length = 0
+    
+    def _abrir(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self._tmp, 'wb')
+    
+    def _escribir(self, data: bytes):
+        self._abrir()
+        self._file.write(data)
+    
+    def _terminar(self):
+        self._abrir()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp, self.path)
+    
+    def _descartar(self, path: str):
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    async def write(self, data: bytes):
+        await asyncio.to_thread(self._escribir, data)
+        self._length += len(data)
+    
+    async def abort(self):
+        await asyncio.to_thread(self._descartar, self._tmp)
+    
+    async def close(self, metadata: Dict[str, Any]):
+        await asyncio.to_thread(self._terminar)
+        try:
+            await mongodb.get_database()[f'{BLOBS_BUCKET}.files'].insert_one({
+                '_id': self._id,
+                'filename': self.filename,
+                'length': self._length,
+                'chunkSize': self.chunk_size,
+                'uploadDate': datetime.utcnow(),
+                'metadata': metadata
+            })
+        except BaseException:
+            await asyncio.to_thread(self._descartar, self.path)
+            raise
+
+class _LecturaLocal:
+    """Lectura de un blob local a través de un mapeo en memoria"""
+    
+    def __init__(self, blob: Dict[str, Any], path: str):
+        self.metadata = blob.get('metadata') or {}
+        self.length = blob['length']
+        self.path = path
+        self._pos = 0
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.length else b''
+    
+    def seek(self, pos: int):
+        self._pos = pos
+    
+    async def readchunk(self) -> bytes:
+        # Hasta el siguiente límite de chunk, igual que GridOut.readchunk
+        fin = min(self.length, (self._pos // LOCAL_CHUNK_SIZE + 1) * LOCAL_CHUNK_SIZE)
+        data = self._mm[self._pos:fin]
+        self._pos += len(data)
+        return data
+    
+    async def read(self, size: int = -1) -> bytes:
+        fin = self.length if size < 0 else min(self.length, self._pos + size)
+        data = self._mm[self._pos:fin]
+        self._pos += len(data)
+        return data
+
+class LocalBlobStore(BlobStore):
+    """Contenido en archivos bajo BLOB_STORE_PATH; en MongoDB solo quedan los metadatos"""
+    nombre = 'local'
+    
+    def __init__(self, root: str):
+        self.root = root
+    
+    def ruta(self, blob_id: ObjectId) -> str:
+        # Dos niveles de directorios para no acumular todos los blobs en uno solo
+        hex_id = str(blob_id)
+        return os.path.join(self.root, hex_id[-2:], hex_id[-4:-2], hex_id)
+    
+    def open_upload_stream(self, filename: str) -> EscrituraBlob:
+        return _EscrituraLocal(self, filename)
+    
+    async def open_download_stream(self, blob: Dict[str, Any]):
+        return await asyncio.to_thread(_LecturaLocal, blob, self.ruta(blob['_id']))
+    
+    async def delete(self, blob_id: ObjectId):
+        try:
+            await asyncio.to_thread(os.remove, self.ruta(blob_id))
+        except FileNotFoundError:
+            pass
+
+class ArchivoAbierto:
+    """Documento abierto para lectura: metadatos de fs.files y contenido desde su blob"""
+    
+    def __init__(self, doc: Dict[str, Any], contenido):
+        self._id = doc['_id']
+        self.filename = doc.get('filename')
+        self.metadata = doc.get('metadata') or {}
+        self.upload_date = doc['uploadDate']
+        self.length = doc['length']
+        self._contenido = contenido
+        self.path = None
+        # El códec lo registra el blob; los archivos sin blob nunca están comprimidos
+        self._codec = (getattr(contenido, 'metadata', None) or {}).get('codec')
+        self._descompresor = _Descompresor(self._codec) if self._codec else None
+        self._saltar = 0
+        self._resto = b''
+        if self._codec is None:
+            # Blobs locales sin comprimir: se pueden servir directo desde el archivo
+            self.path = getattr(contenido, 'path', None)
+    
+    def seek(self, pos: int):
+        if self._codec is None:
+            self._contenido.seek(pos)
+            return
+        # El contenido comprimido no admite acceso aleatorio: se descomprime
+        # desde el inicio y se descartan los bytes anteriores a pos
+        self._contenido.seek(0)
+        self._descompresor = _Descompresor(self._codec)
+        self._saltar = pos
+        self._resto = b''
+    
+    async def readchunk(self) -> bytes:
+        if self._codec is None:
+            return await self._contenido.readchunk()
+        if self._resto:
+            datos, self._resto = self._resto, b''
+            return datos
+        while self._descompresor is not None:
+            # Primero se termina la entrada que el límite de salida dejó pendiente
+            comprimido = b'' if self._descompresor.pendiente else await self._contenido.readchunk()
+            if comprimido or self._descompresor.pendiente:
+                datos = self._descompresor.decompress(comprimido)
+            else:
+                datos = self._descompresor.flush()
+                self._descompresor = None
+            if self._saltar:
+                n = min(self._saltar, len(datos))
+                datos = datos[n:]
+                self._saltar -= n
+            if datos:
+                return datos
+        return b''
+    
+    async def read(self, size: int = -1) -> bytes:
+        if self._codec is None:
+            return await self._contenido.read(size)
+        partes = []
+        total = 0
+        while size < 0 or total < size:
+            datos = await self.readchunk()
+            if not datos:
+                break
+            partes.append(datos)
+            total += len(datos)
+        datos = b''.join(partes)
+        if size >= 0 and len(datos) > size:
+            datos, self._resto = datos[:size], datos[size:]
+        return datos
 
 class GridFSManager:
     def __init__(self):
         self.fs = None
+        self.stores: Dict[str, BlobStore] = {}
+        self.store: Optional[BlobStore] = None
     
     def initialize(self):
         """Inicializar GridFS con la base de datos"""
         if mongodb.db is None:
             raise Exception("MongoDB no está conectado")
-        self.fs = mongo_gridfs.GridFS(mongodb.db)
+        if BLOB_STORE not in ('gridfs', 'local'):
+            raise ValueError(f"BLOB_STORE inválido: {BLOB_STORE}")
+        self.fs = AsyncIOMotorGridFSBucket(mongodb.db)
+        # Se mantienen ambos para leer blobs escritos con otra configuración
+        self.stores = {
+            'gridfs': GridFSBlobStore(AsyncIOMotorGridFSBucket(mongodb.db, bucket_name=BLOBS_BUCKET)),
+            'local': LocalBlobStore(BLOB_STORE_PATH)
+        }
+        self.store = self.stores[BLOB_STORE]
+    
+    async def _reusar_blob(self, sha256: str) -> Optional[ObjectId]:
+        # Suma una referencia al blob con ese hash, si existe
+        db = mongodb.get_database()
+        blob = await db[f'{BLOBS_BUCKET}.files'].find_one_and_update(
+            {'metadata.sha256': sha256},
+            {'$inc': {'metadata.refs': 1}},
+            projection={'_id': 1}
+        )
+        return blob['_id'] if blob else None
+    
+    async def _liberar_blob(self, blob_id: ObjectId):
+        # Resta una referencia y borra el contenido solo cuando no queda ninguna
+        db = mongodb.get_database()
+        blob = await db[f'{BLOBS_BUCKET}.files'].find_one_and_update(
+            {'_id': blob_id},
+            {'$inc': {'metadata.refs': -1}},
+            projection={'metadata.refs': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is None or blob['metadata']['refs'] > 0:
+            return
+        # Condicionado a refs <= 0: una subida concurrente pudo haberlo reutilizado
+        blob = await db[f'{BLOBS_BUCKET}.files'].find_one_and_delete(
+            {'_id': blob_id, 'metadata.refs': {'$lte': 0}},
+            projection={'metadata.store': 1}
+        )
+        if blob is not None:
+            await self.stores[blob['metadata'].get('store', 'gridfs')].delete(blob_id)
+    
+    async def _subir_blob(self, chunks: AsyncIterator[bytes], filename: str) -> Tuple[ObjectId, str, int, int]:
+        """
+        Escribir el contenido en el blob store configurado calculando su SHA-256
+
+        El primer chunk decide si el contenido se comprime (ver _elegir_codec);
+        el hash y el tamaño siempre corresponden al contenido sin comprimir.
+
+        Returns:
+            (ID del blob, sha256, tamaño, chunk size); si el hash ya existía se
+            descartan los chunks escritos y se reutiliza el blob existente
+        """
+        sha256 = hashlib.sha256()
+        length = 0
+        codec = None
+        compresor = None
+        escritura = self.store.open_upload_stream(filename)
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if length == 0:
+                    codec = _elegir_codec(chunk)
+                    compresor = _compresor(codec) if codec else None
+                sha256.update(chunk)
+                length += len(chunk)
+                await escritura.write(compresor.compress(chunk) if compresor else chunk)
+            if compresor:
+                await escritura.write(compresor.flush())
+        except BaseException:
+            await escritura.abort()
+            raise
+        digest = sha256.hexdigest()
+        
+        blob_id = await self._reusar_blob(digest)
+        if blob_id is None:
+            metadata = {'sha256': digest, 'refs': 1, 'codec': codec, 'length': length, 'store': self.store.nombre}
+            try:
+                await escritura.close(metadata)
+                return escritura._id, digest, length, escritura.chunk_size
+            except DuplicateKeyError:
+                # Otra subida del mismo contenido cerró primero
+                blob_id = await self._reusar_blob(digest)
+                if blob_id is None:
+                    raise
+        await escritura.abort()
+        return blob_id, digest, length, escritura.chunk_size
     
-    async def upload_file(self, file_data: bytes, filename: str, metadata: Dict[str, Any] = None) -> str:
+    @medir('gridfs')
+    async def upload_file(
+        self,
+        file_data: Union[bytes, AsyncIterator[bytes], Callable[[], AsyncIterator[bytes]]],
+        filename: str,
+        metadata: Dict[str, Any] = None
+    ) -> str:
         """
         Subir un archivo a GridFS
         
         Args:
-            file_data: Datos del archivo en bytes
+            file_data: Datos del archivo en bytes, un iterador asíncrono de chunks,
+                o una función que entrega un iterador nuevo desde el inicio cada vez
+                que se llama (la fuente se lee dos veces: primero para el hash)
             filename: Nombre del archivo
             metadata: Metadatos adicionales (opcional)
             
@@ -42,19 +505,51 @@ class GridFSManager:
             if metadata:
                 file_metadata.update(metadata)
             
-            # Subir archivo
-            file_id = self.fs.put(
-                file_data,
-                filename=filename,
-                metadata=file_metadata
-            )
+            # Subir contenido deduplicado por SHA-256
+            if isinstance(file_data, (bytes, bytearray)):
+                # Con los bytes completos el hash se conoce antes de escribir nada
+                digest = hashlib.sha256(file_data).hexdigest()
+                blob_id = await self._reusar_blob(digest)
+                if blob_id is not None:
+                    length, chunk_size = len(file_data), None
+                else:
+                    async def unico():
+                        yield bytes(file_data)
+                    blob_id, digest, length, chunk_size = await self._subir_blob(unico(), filename)
+            elif callable(file_data):
+                # La fuente se puede releer: si el hash ya existe no se escribe ningún chunk
+                sha256 = hashlib.sha256()
+                length = 0
+                async for chunk in file_data():
+                    sha256.update(chunk)
+                    length += len(chunk)
+                digest = sha256.hexdigest()
+                blob_id = await self._reusar_blob(digest)
+                chunk_size = None
+                if blob_id is None:
+                    blob_id, digest, length, chunk_size = await self._subir_blob(file_data(), filename)
+            else:
+                blob_id, digest, length, chunk_size = await self._subir_blob(file_data, filename)
+            
+            # La entrada en fs.files guarda los metadatos y apunta al blob
+            file_metadata['sha256'] = digest
+            file_metadata['blob_id'] = blob_id
+            db = mongodb.get_database()
+            result = await db['fs.files'].insert_one({
+                'filename': filename,
+                'length': length,
+                'chunkSize': chunk_size or 255 * 1024,
+                'uploadDate': datetime.utcnow(),
+                'metadata': file_metadata
+            })
             
-            return str(file_id)
+            return str(result.inserted_id)
             
         except Exception as e:
             print(f"Error subiendo archivo: {e}")
             raise e
     
+    @medir('gridfs')
     async def download_file(self, file_id: str) -> Optional[Dict[str, Any]]:
         """
         Descargar un archivo de GridFS
@@ -66,32 +561,27 @@ class GridFSManager:
             Dict con datos del archivo y metadatos
         """
         try:
-            if self.fs is None:
-                self.initialize()
+            file_doc = await self.open_download_stream(file_id)
+            if file_doc is None:
+                return None
             
-            # Obtener archivo por ID
-            file_doc = self.fs.get(ObjectId(file_id))
+            data = await file_doc.read()
             
             return {
                 'id': str(file_doc._id),
                 'filename': file_doc.filename,
-                'data': file_doc.read(),
+                'data': data,
                 'metadata': file_doc.metadata,
                 'upload_date': file_doc.upload_date,
                 'length': file_doc.length,
                 'content_type': file_doc.metadata.get('content_type', 'application/octet-stream')
             }
             
-        except InvalidId:
-            print(f"ID inválido: {file_id}")
-            return None
-        except gridfs.NoFile:
-            print(f"Archivo no encontrado: {file_id}")
-            return None
         except Exception as e:
             print(f"Error descargando archivo: {e}")
             return None
     
+    @medir('gridfs')
     async def download_file_by_name(self, filename: str) -> Optional[Dict[str, Any]]:
         """
         Descargar un archivo por nombre
@@ -102,36 +592,157 @@ class GridFSManager:
         Returns:
             Dict con datos del archivo y metadatos
         """
+        try:
+            # Obtener la última versión del archivo
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one({'filename': filename}, {'_id': 1}, sort=[('uploadDate', -1)])
+            if doc is None:
+                print(f"Archivo no encontrado: {filename}")
+                return None
+            
+            return await self.download_file(str(doc['_id']))
+            
+        except Exception as e:
+            print(f"Error descargando archivo: {e}")
+            return None
+    
+    @medir('gridfs')
+    async def get_file_info(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtener solo los metadatos de un archivo, sin leer fs.chunks
+        
+        Args:
+            file_id: ID del archivo
+            
+        Returns:
+            Dict con metadatos del archivo (sin 'data'), o None si no existe
+        """
         try:
             if self.fs is None:
                 self.initialize()
             
-            # Obtener la última versión del archivo
-            file_doc = self.fs.get_last_version(filename)
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one({'_id': ObjectId(file_id)}, FILE_INFO_PROJECTION)
+            if doc is None:
+                print(f"Archivo no encontrado: {file_id}")
+                return None
             
-            return {
-                'id': str(file_doc._id),
-                'filename': file_doc.filename,
-                'data': file_doc.read(),
-                'metadata': file_doc.metadata,
-                'upload_date': file_doc.upload_date,
-                'length': file_doc.length,
-                'content_type': file_doc.metadata.get('content_type', 'application/octet-stream')
-            }
+            return _file_info(doc)
             
-        except gridfs.NoFile:
-            print(f"Archivo no encontrado: {filename}")
+        except InvalidId:
+            print(f"ID inválido: {file_id}")
             return None
         except Exception as e:
-            print(f"Error descargando archivo: {e}")
+            print(f"Error obteniendo metadatos: {e}")
             return None
     
-    async def list_files(self, filter_metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    @medir('gridfs')
+    async def open_download_stream(self, file_id: str) -> Optional[ArchivoAbierto]:
         """
-        Listar archivos en GridFS
+        Abrir un archivo para lectura incremental sin cargar sus datos
+        
+        Args:
+            file_id: ID del archivo
+            
+        Returns:
+            ArchivoAbierto con los metadatos del archivo, o None si no existe
+        """
+        try:
+            if self.fs is None:
+                self.initialize()
+            
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one({'_id': ObjectId(file_id)})
+            if doc is None:
+                print(f"Archivo no encontrado: {file_id}")
+                return None
+            
+            blob_id = (doc.get('metadata') or {}).get('blob_id')
+            if blob_id is not None:
+                blob = await db[f'{BLOBS_BUCKET}.files'].find_one({'_id': blob_id})
+                if blob is None:
+                    raise mongo_gridfs.NoFile(blob_id)
+                store = self.stores[(blob.get('metadata') or {}).get('store', 'gridfs')]
+                contenido = await store.open_download_stream(blob)
+            else:
+                # Archivos anteriores a la deduplicación guardan sus propios chunks
+                contenido = await self.fs.open_download_stream(doc['_id'])
+            
+            return ArchivoAbierto(doc, contenido)
+            
+        except InvalidId:
+            print(f"ID inválido: {file_id}")
+            return None
+        except mongo_gridfs.NoFile:
+            print(f"Archivo no encontrado: {file_id}")
+            return None
+        except Exception as e:
+            print(f"Error abriendo archivo: {e}")
+            return None
+    
+    async def stream_file(self, file_doc, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Leer un archivo abierto chunk por chunk
+        
+        Args:
+            file_doc: ArchivoAbierto devuelto por open_download_stream
+            start: Primer byte a leer (inclusive)
+            end: Último byte a leer (inclusive), por defecto el final del archivo
+            
+        Yields:
+            bytes: Como máximo un chunk de GridFS por iteración
+        """
+        if end is None:
+            end = file_doc.length - 1
+        
+        file_doc.seek(start)
+        remaining = end - start + 1
+        
+        while remaining > 0:
+            # readchunk devuelve lo que queda del chunk actual, nunca el archivo completo
+            chunk = await file_doc.readchunk()
+            if not chunk:
+                break
+            if len(chunk) > remaining:
+                chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+    
+    @medir('gridfs')
+    async def hash_file(self, file_doc: ArchivoAbierto) -> str:
+        """
+        Calcular el SHA-256 del contenido leyendo chunk por chunk en el servidor
+        
+        Args:
+            file_doc: ArchivoAbierto devuelto por open_download_stream
+            
+        Returns:
+            str: Digest hexadecimal
+        """
+        sha256 = hashlib.sha256()
+        async for chunk in self.stream_file(file_doc):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+    
+    @medir('gridfs')
+    async def list_files(
+        self,
+        filter_metadata: Dict[str, Any] = None,
+        limit: Optional[int] = None,
+        after_id: Optional[ObjectId] = None,
+        fields: Optional[List[str]] = None,
+        filters: Dict[str, Any] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Listar archivos en GridFS, ordenados por _id
         
         Args:
             filter_metadata: Filtros para metadatos
+            limit: Cantidad máxima de archivos (opcional)
+            after_id: Devolver solo archivos con _id mayor a este (paginación por cursor)
+            fields: Campos de fs.files a proyectar; si se indica se devuelven los
+                documentos tal cual, con 'id' en vez de '_id'
+            filters: Filtros adicionales sobre campos de fs.files (ej. uploadDate)
             
         Returns:
             Lista de archivos con metadatos
@@ -141,24 +752,27 @@ class GridFSManager:
                 self.initialize()
             
             # Construir filtro
-            query = {}
+            query = dict(filters) if filters else {}
             if filter_metadata:
                 for key, value in filter_metadata.items():
                     query[f'metadata.{key}'] = value
+            if after_id is not None:
+                query['_id'] = {'$gt': after_id}
             
-            # Buscar archivos
-            files = self.fs.find(query)
+            # Buscar solo en fs.files, sin abrir los archivos
+            projection = {field: 1 for field in fields} if fields else FILE_INFO_PROJECTION
+            db = mongodb.get_database()
+            cursor = db['fs.files'].find(query, projection).sort('_id', 1)
+            if limit:
+                cursor = cursor.limit(limit)
             
             result = []
-            for file_doc in files:
-                result.append({
-                    'id': str(file_doc._id),
-                    'filename': file_doc.filename,
-                    'metadata': file_doc.metadata,
-                    'upload_date': file_doc.upload_date,
-                    'length': file_doc.length,
-                    'content_type': file_doc.metadata.get('content_type', 'application/octet-stream')
-                })
+            async for doc in cursor:
+                if fields:
+                    doc['id'] = str(doc.pop('_id'))
+                    result.append(doc)
+                else:
+                    result.append(_file_info(doc))
             
             return result
             
@@ -166,10 +780,14 @@ class GridFSManager:
             print(f"Error listando archivos: {e}")
             return []
     
+    @medir('gridfs')
     async def delete_file(self, file_id: str) -> bool:
         """
         Eliminar un archivo de GridFS
         
+        Los chunks compartidos solo se borran cuando se elimina la última
+        referencia a ese contenido.
+        
         Args:
             file_id: ID del archivo
             
@@ -180,19 +798,30 @@ class GridFSManager:
             if self.fs is None:
                 self.initialize()
             
-            self.fs.delete(ObjectId(file_id))
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one_and_delete(
+                {'_id': ObjectId(file_id)},
+                projection={'metadata.blob_id': 1}
+            )
+            if doc is None:
+                print(f"Archivo no encontrado: {file_id}")
+                return False
+            
+            blob_id = (doc.get('metadata') or {}).get('blob_id')
+            if blob_id is None:
+                await db['fs.chunks'].delete_many({'files_id': doc['_id']})
+            else:
+                await self._liberar_blob(blob_id)
             return True
             
         except InvalidId:
             print(f"ID inválido: {file_id}")
             return False
-        except gridfs.NoFile:
-            print(f"Archivo no encontrado: {file_id}")
-            return False
         except Exception as e:
             print(f"Error eliminando archivo: {e}")
             return False
     
+    @medir('gridfs')
     async def update_file_metadata(self, file_id: str, new_metadata: Dict[str, Any]) -> bool:
         """
         Actualizar metadatos de un archivo
@@ -213,7 +842,7 @@ class GridFSManager:
             db = mongodb.get_database()
             files_collection = db['fs.files']
             
-            result = files_collection.update_one(
+            result = await files_collection.update_one(
                 {'_id': ObjectId(file_id)},
                 {'$set': {'metadata': new_metadata}}
             )
@@ -227,6 +856,89 @@ class GridFSManager:
             print(f"Error actualizando metadatos: {e}")
             return False
     
+    @medir('gridfs')
+    async def update_metadata_fields(
+        self,
+        file_id: str,
+        fields: Dict[str, Any],
+        condition: Dict[str, Any] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Actualizar campos puntuales de metadata en una sola operación atómica
+        
+        Args:
+            file_id: ID del archivo
+            fields: Campos de metadata a asignar
+            condition: Valores de metadata que deben cumplirse para actualizar (opcional)
+            
+        Returns:
+            Dict con los metadatos ya actualizados, o None si el archivo no existe
+            o no cumple la condición
+        """
+        try:
+            if self.fs is None:
+                self.initialize()
+            
+            query = {'_id': ObjectId(file_id)}
+            if condition:
+                for key, value in condition.items():
+                    query[f'metadata.{key}'] = value
+            
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one_and_update(
+                query,
+                {'$set': {f'metadata.{key}': value for key, value in fields.items()}},
+                projection=FILE_INFO_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            
+            return _file_info(doc) if doc else None
+            
+        except InvalidId:
+            print(f"ID inválido: {file_id}")
+            return None
+        except Exception as e:
+            print(f"Error actualizando metadatos: {e}")
+            return None
+    
+    @medir('gridfs')
+    async def bulk_update_metadata_fields(
+        self,
+        updates: List[Tuple[ObjectId, Dict[str, Any]]],
+        condition: Dict[str, Any] = None
+    ) -> int:
+        """
+        Actualizar campos de metadata de varios archivos con un solo bulk_write
+        
+        Args:
+            updates: Pares (ID del archivo, campos de metadata a asignar)
+            condition: Valores de metadata que cada archivo debe cumplir (opcional)
+            
+        Returns:
+            int: Cantidad de archivos modificados
+        """
+        if not updates:
+            return 0
+        
+        if self.fs is None:
+            self.initialize()
+        
+        operations = []
+        for file_id, fields in updates:
+            query = {'_id': file_id}
+            if condition:
+                for key, value in condition.items():
+                    query[f'metadata.{key}'] = value
+            operations.append(UpdateOne(
+                query,
+                {'$set': {f'metadata.{key}': value for key, value in fields.items()}}
+            ))
+        
+        db = mongodb.get_database()
+        result = await db['fs.files'].bulk_write(operations, ordered=False)
+        return result.modified_count
+    
+    @medir('gridfs')
     async def file_exists(self, file_id: str) -> bool:
         """
         Verificar si un archivo existe
@@ -241,7 +953,9 @@ class GridFSManager:
             if self.fs is None:
                 self.initialize()
             
-            return self.fs.exists(ObjectId(file_id))
+            db = mongodb.get_database()
+            doc = await db['fs.files'].find_one({'_id': ObjectId(file_id)}, {'_id': 1})
+            return doc is not None
             
         except InvalidId:
             return False
@@ -0,0 +1,142 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, List, Sequence, Tuple
+
+# Límites por defecto de los histogramas de latencia (segundos)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _etiquetas(nombres: Sequence[str], valores: Tuple) -> str:
+    if not nombres:
+        return ''
+    pares = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+class Counter:
+    """Contador acumulado por combinación de etiquetas"""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores: Dict[Tuple, float] = {}
+
+    def inc(self, cantidad: float = 1, *valores) -> None:
+        self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def render(self) -> List[str]:
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} counter']
+        for valores, total in sorted(self._valores.items()):
+            lineas.append(f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}')
+        return lineas
+
+class Histogram:
+    """Histograma con buckets fijos por combinación de etiquetas"""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        # valores de etiquetas -> [cuentas por bucket (+Inf al final), suma]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, valor: float, *valores) -> None:
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+        # Solo se incrementa un bucket; los acumulados se calculan al exportar
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def render(self) -> List[str]:
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for valores, (cuentas, suma) in sorted(self._series.items()):
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets + ('+Inf',), cuentas):
+                acumulado += cuenta
+                etiquetas = _etiquetas(self.etiquetas + ('le',), valores + (limite,))
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _etiquetas(self.etiquetas, valores)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {suma}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {acumulado}')
+        return lineas
+
+HTTP_REQUESTS = Histogram(
+    'http_request_duration_seconds',
+    'Duración de las peticiones HTTP por ruta y estado',
+    ('method', 'route', 'status')
+)
+OPERACIONES = Histogram(
+    'firmasimple_operation_duration_seconds',
+    'Duración de las operaciones de lib/data.py y GridFSManager',
+    ('module', 'operation', 'outcome')
+)
+DOCUMENTO_BYTES = Counter(
+    'firmasimple_document_bytes_total',
+    'Bytes de documentos subidos y descargados',
+    ('direction',)
+)
+FIRMA_PDF = Histogram(
+    'firmasimple_pdf_sign_duration_seconds',
+    'Duración de la firma de PDFs en el pool de procesos',
+    ('mode',)
+)
+
+METRICAS = (HTTP_REQUESTS, OPERACIONES, DOCUMENTO_BYTES, FIRMA_PDF)
+
+def render_metricas() -> str:
+    """Exportar todas las métricas en el formato de texto de Prometheus"""
+    lineas = []
+    for metrica in METRICAS:
+        lineas.extend(metrica.render())
+    return '\n'.join(lineas) + '\n'
+
+def medir(modulo: str):
+    """Decorador que registra la duración de una corrutina en OPERACIONES"""
+    def decorador(func):
+        operacion = func.__name__
+
+        @wraps(func)
+        async def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            outcome = 'error'
+            try:
+                resultado = await func(*args, **kwargs)
+                outcome = 'ok'
+                return resultado
+            finally:
+                OPERACIONES.observe(time.perf_counter() - inicio, modulo, operacion, outcome)
+        return envoltura
+    return decorador
+
+class MetricasMiddleware:
+    """Middleware ASGI que mide cada petición HTTP por plantilla de ruta y estado"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        status = 500
+
+        async def send_con_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_status)
+        finally:
+            # La plantilla (/api/documentos/{documento_id}) evita una serie por ID
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'sin_ruta'
+            HTTP_REQUESTS.observe(time.perf_counter() - inicio, scope['method'], path, status)
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, ConfigDict
 import datetime
 from enum import Enum
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel, Field
 from bson import ObjectId
 
@@ -76,4 +76,36 @@ class FirmaDocumento(BaseModel):
     fecha_firma: datetime.datetime
     metadata_firma: Optional[dict] = None
 
-    model_config = ConfigDict(arbitrary_types_allowed=True)
\ No newline at end of file
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+class ResultadoFirma(BaseModel):
+    documento_id: str
+    firmado: bool
+    error: Optional[str] = None
+
+class ErrorFilaUsuario(BaseModel):
+    fila: int
+    correo: Optional[str] = None
+    error: str
+
+class ResultadoLoteUsuarios(BaseModel):
+    insertados: int
+    errores: List[ErrorFilaUsuario]
+
+class FirmaPdfDocumento(BaseModel):
+    nombre: str
+    rut: str
+    correo: str
+    firmado_por: Optional[str] = None
+    fecha_firma: Optional[datetime.datetime] = None
+    incremental: bool = True
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+class VerificacionDocumento(BaseModel):
+    documento_id: str
+    sha256: str
+    valido: bool
+    verificado_en: datetime.datetime
+    en_cache: bool = False
+    mensaje: str
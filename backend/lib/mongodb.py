@@ -1,11 +1,40 @@
 import os
 from typing import List, Optional
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
 from bson import ObjectId
 from bson.errors import InvalidId
 from .modelos import Usuario, UsuarioWithId, Solicitudes, SolicitudCreate
 
+# Índices requeridos por las consultas de lib/data.py y lib/gridfs_manager.py
+# (blobs.files: el hash único es lo que permite deduplicar contenido)
+INDEXES = {
+    'Usuarios': [
+        IndexModel([('correo', ASCENDING)], name='correo_unique', unique=True),
+    ],
+    'Solicitudes': [
+        IndexModel([('fecha', DESCENDING), ('_id', DESCENDING)], name='fecha_id_desc'),
+        IndexModel([('estado', ASCENDING), ('fecha', DESCENDING), ('_id', DESCENDING)], name='estado_fecha'),
+        IndexModel([('empleado.correo', ASCENDING), ('fecha', DESCENDING), ('_id', DESCENDING)], name='empleado_fecha'),
+        IndexModel([('supervisor.correo', ASCENDING), ('fecha', DESCENDING), ('_id', DESCENDING)], name='supervisor_fecha'),
+        IndexModel([('categoria', ASCENDING), ('fecha', DESCENDING), ('_id', DESCENDING)], name='categoria_fecha'),
+        IndexModel([('titulo', TEXT), ('descripcion', TEXT)], name='texto', default_language='spanish'),
+    ],
+    'fs.files': [
+        IndexModel([('metadata.solicitud_id', ASCENDING), ('metadata.firmado', ASCENDING)], name='solicitud_firmado'),
+        IndexModel([('metadata.firmado', ASCENDING), ('_id', ASCENDING)], name='firmado_id'),
+        IndexModel([('metadata.estado', ASCENDING), ('_id', ASCENDING)], name='estado_id'),
+        IndexModel([('metadata.firmado_por', ASCENDING), ('_id', ASCENDING)], name='firmado_por_id'),
+        IndexModel([('uploadDate', DESCENDING), ('_id', ASCENDING)], name='upload_date_id'),
+        # GridFS lo crea solo al escribir con GridIn; fs.files ahora se inserta directo.
+        # Mismo nombre que el de GridFS para no chocar en bases que ya lo tienen
+        IndexModel([('filename', ASCENDING), ('uploadDate', ASCENDING)], name='filename_1_uploadDate_1'),
+    ],
+    'blobs.files': [
+        IndexModel([('metadata.sha256', ASCENDING)], name='sha256_unique', unique=True, sparse=True),
+    ],
+}
+
 class MongoDB:
     def __init__(self):
         self.client = None
@@ -16,17 +45,27 @@ class MongoDB:
         mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
         db_name = os.getenv('MONGO_DB', 'FirmaSimple')
         
-        self.client = MongoClient(mongo_uri)
+        # Cliente asíncrono: las operaciones no bloquean el event loop
+        self.client = AsyncIOMotorClient(mongo_uri)
         self.db = self.client[db_name]
         
         # Verificar conexión
         try:
-            self.client.admin.command('ping')
+            await self.client.admin.command('ping')
             print("Conexión exitosa a MongoDB")
         except Exception as e:
             print(f"Error conectando a MongoDB: {e}")
             raise
     
+    async def ensure_indexes(self):
+        # create_indexes es idempotente: si el índice ya existe no hace nada
+        for collection_name, indexes in INDEXES.items():
+            try:
+                await self.db[collection_name].create_indexes(indexes)
+            except Exception as e:
+                print(f"Error creando índices en {collection_name}: {e}")
+                raise
+    
     def get_database(self):
         return self.db
 
@@ -0,0 +1,19 @@
+from typing import Any
+import orjson
+from bson import ObjectId
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+def _default(obj: Any) -> Any:
+    # orjson ya serializa datetime, date, UUID y Enum; solo faltan tipos propios
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+class RespuestaJSON(JSONResponse):
+    """Respuesta JSON serializada con orjson, sin pasar por jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
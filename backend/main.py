@@ -1,20 +1,41 @@
-import io
-from tkinter import Canvas
-from PyPDF2 import PdfReader, PdfWriter
-from fastapi import Body, FastAPI, HTTPException, UploadFile, File, Form
-from reportlab.lib.pagesizes import letter
-from fastapi.responses import StreamingResponse
+import asyncio
+import csv
+import json
+import os
+import unicodedata
+from datetime import timezone
+from email.utils import format_datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import quote
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request, UploadFile, File, Form
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pymongo.errors import DuplicateKeyError
 from lib.data import (
-    get_usuarios, add_usuario, upload_documento, get_usuario_by_id, delete_usuario, get_usuario_by_correo,
-    get_solicitudes, get_solicitud_by_id, add_solicitud, delete_solicitud, update_solicitud,
-    get_documento_by_id, download_documento, get_documentos_by_solicitud,
-    firmar_documento, delete_documento, get_documentos_firmados, get_documentos_pendientes
+    get_usuarios, get_usuario_cache_stats, add_usuario, add_usuarios, upload_documento, get_usuario_by_id, delete_usuario, get_usuario_by_correo,
+    get_solicitudes, buscar_solicitudes, get_solicitud_by_id, add_solicitud, delete_solicitud, update_solicitud,
+    get_documento_by_id, open_documento_stream, stream_documento, get_documentos_by_solicitud,
+    firmar_documento, firmar_documentos, firmar_documento_pdf, read_documento, delete_documento, verificar_documento, get_documentos_firmados, get_documentos_pendientes,
+    buscar_documentos
 )
-from lib.modelos import Usuario, Solicitudes, SolicitudCreate, DocumentoUpload, DocumentoFirmado, FirmaDocumento
+from lib.modelos import Usuario, UsuarioWithId, Solicitudes, SolicitudCreate, DocumentoUpload, DocumentoFirmado, FirmaDocumento, ResultadoFirma, FirmaPdfDocumento, VerificacionDocumento, ResultadoLoteUsuarios
 from lib.mongodb import mongodb
+from lib.firma_pdf import ColaPdfLlena, pdf_pool
+from lib.metricas import DOCUMENTO_BYTES, MetricasMiddleware, render_metricas
+from lib.respuestas import RespuestaJSON
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# orjson para todas las respuestas; las rutas con tipo de retorno usan la
+# serialización de Pydantic, que FastAPI ya hace directo a bytes
+app = FastAPI(default_response_class=RespuestaJSON)
+
+# Límite de tamaño para PDFs subidos (bytes) y tamaño de lectura por chunk
+MAX_PDF_SIZE = int(os.getenv('MAX_PDF_SIZE', 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 255 * 1024
+PDF_MAGIC = b"%PDF-"
+
+# Tamaño de página por defecto y máximo para los listados
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,35 +43,142 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetricasMiddleware)
 
 @app.on_event("startup")
 async def startup_event():
     await mongodb.connect()
+    await mongodb.ensure_indexes()
+    pdf_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    pdf_pool.shutdown()
+
+# -- PAGINACIÓN
+
+def _split_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+async def _pagina(listar, limit: int, cursor: Optional[str], fields: Optional[str]) -> RespuestaJSON:
+    # El cuerpo sigue siendo una lista; el cursor de la página siguiente va en X-Next-Cursor.
+    # Se devuelve la respuesta ya armada para no pasar la lista por jsonable_encoder
+    try:
+        items, next_cursor = await listar(limit, cursor, _split_fields(fields))
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return RespuestaJSON(items, headers=headers)
+
+# -- METRICAS
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metricas(), media_type="text/plain; version=0.0.4")
 
 # -- ENDPOINTS USUARIOS
 
 @app.get("/api/usuarios")
-async def listar_usuarios():
-    return await get_usuarios()
+async def listar_usuarios(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    return await _pagina(get_usuarios, limit, cursor, fields)
+
+@app.get("/api/usuarios/cache")
+async def estadisticas_cache_usuarios():
+    return get_usuario_cache_stats()
 
 @app.get("/api/usuarios/{usuario_id}")
-async def obtener_usuario(usuario_id: str):
+async def obtener_usuario(usuario_id: str) -> UsuarioWithId:
     usuario = await get_usuario_by_id(usuario_id)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return usuario
 
 @app.get("/api/usuarios/correo/{correo}")
-async def obtener_usuario_por_correo(correo: str):
+async def obtener_usuario_por_correo(correo: str) -> UsuarioWithId:
     usuario = await get_usuario_by_correo(correo)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return usuario
 
 @app.post("/api/agregarUsuarios")
-async def crear_usuario(usuario: Usuario):
-    return await add_usuario(usuario)
+async def crear_usuario(usuario: Usuario) -> UsuarioWithId:
+    try:
+        return await add_usuario(usuario)
+    except DuplicateKeyError:
+        # Índice único correo_unique
+        raise HTTPException(status_code=409, detail="Ya existe un usuario con ese correo")
+
+async def _lineas(request: Request) -> AsyncIterator[str]:
+    # Líneas completas del cuerpo a medida que llega, sin leerlo entero
+    pendiente = b""
+    async for chunk in request.stream():
+        pendiente += chunk
+        *lineas, pendiente = pendiente.split(b"\n")
+        for linea in lineas:
+            yield linea.decode("utf-8-sig").rstrip("\r")
+    if pendiente:
+        yield pendiente.decode("utf-8-sig").rstrip("\r")
+
+async def _filas_ndjson(request: Request):
+    fila = 0
+    async for linea in _lineas(request):
+        if not linea.strip():
+            continue
+        fila += 1
+        try:
+            yield fila, json.loads(linea)
+        except ValueError:
+            yield fila, ValueError("JSON inválido")
+
+async def _filas_csv(request: Request):
+    # Una fila por línea con encabezado nombre,correo,rol,contraseña; no se
+    # admiten campos con saltos de línea
+    encabezado = None
+    fila = 0
+    async for linea in _lineas(request):
+        if not linea.strip():
+            continue
+        valores = next(csv.reader([linea]))
+        if encabezado is None:
+            encabezado = [valor.strip() for valor in valores]
+            continue
+        fila += 1
+        if len(valores) != len(encabezado):
+            yield fila, ValueError(f"Se esperaban {len(encabezado)} columnas")
+            continue
+        yield fila, dict(zip(encabezado, valores))
+
+async def _filas_json(request: Request):
+    try:
+        datos = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if not isinstance(datos, list):
+        raise HTTPException(status_code=400, detail="Se esperaba una lista de usuarios")
+    for fila, usuario in enumerate(datos, start=1):
+        yield fila, usuario
+
+@app.post("/api/usuarios/lote")
+async def crear_usuarios_lote(request: Request) -> ResultadoLoteUsuarios:
+    # JSON (lista), NDJSON o CSV según Content-Type; NDJSON y CSV se procesan en streaming
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        filas = _filas_ndjson(request)
+    elif content_type in ("text/csv", "application/csv"):
+        filas = _filas_csv(request)
+    elif content_type in ("application/json", ""):
+        filas = _filas_json(request)
+    else:
+        raise HTTPException(status_code=415, detail="Formato no soportado: use JSON, NDJSON o CSV")
+    return await add_usuarios(filas)
 
 @app.delete("/api/usuarios/{usuario_id}")
 async def eliminar_usuario(usuario_id: str):
@@ -62,8 +190,45 @@ async def eliminar_usuario(usuario_id: str):
 # -- ENDPOINTS SOLICITUDES
 
 @app.get("/api/solicitudes")
-async def listar_solicitudes():
-    return await get_solicitudes()
+async def listar_solicitudes(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expandir: bool = False
+):
+    async def listar(limit, cursor, fields):
+        return await get_solicitudes(limit, cursor, fields, expandir)
+    return await _pagina(listar, limit, cursor, fields)
+
+@app.get("/api/solicitudes/buscar")
+async def buscar_solicitudes_endpoint(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    estado: Optional[str] = None,
+    empleado_correo: Optional[str] = Query(None, alias="empleado.correo"),
+    supervisor_correo: Optional[str] = Query(None, alias="supervisor.correo"),
+    categoria: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expandir: bool = False
+):
+    async def listar(limit, cursor, fields):
+        return await buscar_solicitudes(
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            estado=estado,
+            empleado_correo=empleado_correo,
+            supervisor_correo=supervisor_correo,
+            categoria=categoria,
+            texto=q,
+            limit=limit,
+            cursor=cursor,
+            fields=fields,
+            expandir=expandir
+        )
+    return await _pagina(listar, limit, cursor, fields)
 
 @app.get("/api/solicitudes/{solicitud_id}")
 async def obtener_solicitud(solicitud_id: str):
@@ -92,6 +257,19 @@ async def actualizar_solicitud(solicitud_id: str, update_data: dict = Body(...))
 
 # -- ENDPOINTS DOCUMENTOS
 
+async def _chunks_pdf(file: UploadFile, max_size: int) -> AsyncIterator[bytes]:
+    # Entrega el archivo desde el inicio chunk por chunk, cortando apenas se supera el límite
+    await file.seek(0)
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido.")
+        yield chunk
+
 @app.post("/api/agregarPDF")
 async def test_upload_pdf(
     solicitud_id: str = Form(...),
@@ -101,31 +279,191 @@ async def test_upload_pdf(
     # Solo aceptar PDFs
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
-    file_data = await file.read()
+    if file.size is not None and file.size > MAX_PDF_SIZE:
+        raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido.")
+
+    # Validar la firma %PDF- con el primer chunk, antes de escribir nada en GridFS
+    first_chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    if not first_chunk.startswith(PDF_MAGIC):
+        raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
+    if len(first_chunk) > MAX_PDF_SIZE:
+        raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido.")
+
     documento_info = DocumentoUpload(
         solicitud_id=solicitud_id,
         filename=filename,
         content_type=file.content_type
     )
-    file_id = await upload_documento(file_data, documento_info)
+    recibidos = 0
+
+    async def contenido():
+        # UploadFile ya está en un archivo temporal: se puede leer una vez para el
+        # hash y otra para escribir, así un duplicado no escribe chunks
+        nonlocal recibidos
+        recibidos = 0
+        async for chunk in _chunks_pdf(file, MAX_PDF_SIZE):
+            recibidos += len(chunk)
+            yield chunk
+
+    file_id = await upload_documento(contenido, documento_info)
+    # Solo cuenta lo que envió el cliente; las copias firmadas y el seed no
+    DOCUMENTO_BYTES.inc(recibidos, "upload")
     return {"file_id": file_id, "message": "Archivo PDF subido correctamente"}
 
+@app.get("/api/documentos/firmados")
+async def listar_documentos_firmados(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    return await _pagina(get_documentos_firmados, limit, cursor, fields)
+
+@app.get("/api/documentos/pendientes")
+async def listar_documentos_pendientes(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    return await _pagina(get_documentos_pendientes, limit, cursor, fields)
+
+@app.get("/api/documentos/buscar")
+async def buscar_documentos_endpoint(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    firmado: Optional[bool] = None,
+    estado: Optional[str] = None,
+    solicitud_id: Optional[str] = None,
+    firmado_por: Optional[str] = None,
+    filename: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    async def listar(limit, cursor, fields):
+        return await buscar_documentos(
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            firmado=firmado,
+            estado=estado,
+            solicitud_id=solicitud_id,
+            firmado_por=firmado_por,
+            filename=filename,
+            limit=limit,
+            cursor=cursor,
+            fields=fields
+        )
+    return await _pagina(listar, limit, cursor, fields)
+
 @app.get("/api/documentos/{documento_id}")
-async def obtener_documento(documento_id: str):
+async def obtener_documento(documento_id: str) -> DocumentoFirmado:
     doc = await get_documento_by_id(documento_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Documento no encontrado")
     return doc
 
+def _content_disposition(filename: str) -> str:
+    # Los headers van en Latin-1: nombre ASCII entre comillas más filename* en
+    # UTF-8 (RFC 5987) para los clientes que lo soportan
+    # Las tildes se pierden ("ñ" -> "n"); cualquier otro carácter no ASCII queda como "_"
+    ascii_name = "".join(
+        c if c.isascii() and c.isprintable() else "_"
+        for c in unicodedata.normalize("NFKD", filename)
+        if not unicodedata.combining(c)
+    )
+    ascii_name = ascii_name.replace("\\", "\\\\").replace('"', '\\"') or "documento"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def _parse_range(range_header: str, length: int) -> Optional[Tuple[int, int]]:
+    # Solo se soporta un rango simple en bytes; cualquier otra forma se ignora
+    # y se responde el archivo completo, como permite RFC 9110
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    spec = range_header[len("bytes="):].strip()
+    start_str, sep, end_str = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if start_str == "":
+            suffix = int(end_str)
+            if suffix <= 0 or length == 0:
+                raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{length}"})
+            return max(0, length - suffix), length - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else length - 1
+    except ValueError:
+        return None
+    # Antes que end < start: en "bytes=N-" con N fuera del archivo end queda en length - 1
+    if start >= length:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{length}"})
+    if end < start:
+        return None
+    return start, min(end, length - 1)
+
+async def _contar_descarga(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Solo cuenta lo que sale por HTTP; las lecturas internas (verificar, firmar) no
+    async for chunk in chunks:
+        DOCUMENTO_BYTES.inc(len(chunk), "download")
+        yield chunk
+
 @app.get("/api/documentos/{documento_id}/descargar")
-async def descargar_documento(documento_id: str):
-    doc = await download_documento(documento_id)
-    if not doc:
+async def descargar_documento(
+    documento_id: str,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None)
+):
+    file_doc = await open_documento_stream(documento_id)
+    if not file_doc:
         raise HTTPException(status_code=404, detail="Documento no encontrado")
-    return doc
+
+    length = file_doc.length
+    etag = f'"{file_doc._id}"'
+    last_modified = format_datetime(file_doc.upload_date.replace(tzinfo=timezone.utc), usegmt=True)
+    content_type = (file_doc.metadata or {}).get("content_type", "application/pdf")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Content-Disposition": _content_disposition(file_doc.filename or "documento"),
+    }
+
+    # If-Range: solo se respeta el rango si el cliente tiene la misma versión
+    byte_range = None
+    if range and (if_range is None or if_range in (etag, last_modified)):
+        byte_range = _parse_range(range, length)
+
+    if file_doc.path:
+        # Blob local: FileResponse resuelve Range/If-Range con estos ETag y
+        # Last-Modified y usa sendfile (pathsend) cuando el servidor lo soporta
+        start, end = byte_range or (0, length - 1)
+        DOCUMENTO_BYTES.inc(end - start + 1, "download")
+        return FileResponse(file_doc.path, media_type=content_type, headers=headers)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(_contar_descarga(stream_documento(file_doc)), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _contar_descarga(stream_documento(file_doc, start, end)),
+        status_code=206,
+        media_type=content_type,
+        headers=headers
+    )
+
+@app.get("/api/documentos/{documento_id}/verificar")
+async def verificar_integridad_documento(
+    documento_id: str,
+    usar_cache: bool = Query(False)
+) -> VerificacionDocumento:
+    verificacion = await verificar_documento(documento_id, usar_cache)
+    if not verificacion:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    return verificacion
 
 @app.get("/api/solicitudes/{solicitud_id}/documentos")
-async def documentos_por_solicitud(solicitud_id: str):
+async def documentos_por_solicitud(solicitud_id: str) -> List[DocumentoFirmado]:
     return await get_documentos_by_solicitud(solicitud_id)
 
 # -- ENDPOINTS FIRMAS
@@ -134,9 +472,17 @@ async def documentos_por_solicitud(solicitud_id: str):
 async def firmar_un_documento(firma: FirmaDocumento):
     ok = await firmar_documento(firma)
     if not ok:
+        # Distinguir una doble firma de un documento inexistente
+        doc = await get_documento_by_id(firma.documento_id)
+        if doc and doc.firmado:
+            raise HTTPException(status_code=409, detail="El documento ya fue firmado")
         raise HTTPException(status_code=400, detail="No se pudo firmar el documento")
     return {"message": "Documento firmado"}
 
+@app.post("/api/documentos/firmar/lote")
+async def firmar_lote_documentos(firmas: List[FirmaDocumento]) -> List[ResultadoFirma]:
+    return await firmar_documentos(firmas)
+
 @app.delete("/api/documentos/{documento_id}")
 async def eliminar_documento(documento_id: str):
     ok = await delete_documento(documento_id)
@@ -144,53 +490,82 @@ async def eliminar_documento(documento_id: str):
         raise HTTPException(status_code=404, detail="Documento no encontrado o no eliminado")
     return {"message": "Documento eliminado"}
 
-@app.get("/api/documentos/firmados")
-async def listar_documentos_firmados():
-    return await get_documentos_firmados()
+@app.post("/api/documentos/{documento_id}/firmar-pdf")
+async def firmar_pdf_guardado(documento_id: str, firma: FirmaPdfDocumento):
+    doc = await get_documento_by_id(documento_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    if doc.firmado:
+        raise HTTPException(status_code=409, detail="El documento ya fue firmado")
+
+    try:
+        firmado_id = await firmar_documento_pdf(documento_id, firma)
+    except ColaPdfLlena as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="La firma del PDF excedió el tiempo máximo")
+
+    if not firmado_id:
+        raise HTTPException(status_code=409, detail="El documento ya fue firmado")
+    return {"documento_id": documento_id, "firmado_id": firmado_id, "message": "Documento firmado"}
+
+@app.post("/api/documentos/firmar-pdf/lote")
+async def firmar_pdf_lote(
+    nombre: str = Form(...),
+    rut: str = Form(...),
+    correo: str = Form(...),
+    incremental: bool = Form(True),
+    files: List[UploadFile] = File(None),
+    documento_ids: List[str] = Form(None)
+):
+    # Cada PDF se lee recién cuando le toca firmarse
+    cargas = []
+    for file in files or []:
+        async def cargar_archivo(file=file):
+            return file.filename, await file.read()
+        cargas.append(cargar_archivo)
+    for documento_id in documento_ids or []:
+        async def cargar_documento(documento_id=documento_id):
+            return await read_documento(documento_id)
+        cargas.append(cargar_documento)
+
+    if not cargas:
+        raise HTTPException(status_code=400, detail="Debe enviar archivos PDF o IDs de documentos")
 
-@app.get("/api/documentos/pendientes")
-async def listar_documentos_pendientes():
-    return await get_documentos_pendientes()
+    return StreamingResponse(
+        pdf_pool.firmar_zip(cargas, nombre, rut, correo, incremental),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=documentos_firmados.zip"}
+    )
 
 @app.post("/api/documentos/firmar-pdf")
 async def firmar_pdf_simple(
     nombre: str = Form(...),
     rut: str = Form(...),
     correo: str = Form(...),
+    incremental: bool = Form(True),
     file: UploadFile = File(...)
 ):
     # Leer PDF original
     original_pdf = await file.read()
-    reader = PdfReader(io.BytesIO(original_pdf))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-
 
-    # Crear página de firma
-    packet = io.BytesIO()
-    can = Canvas.Canvas(packet, pagesize=letter)
-    can.setFont("Helvetica", 12)
-    can.drawString(100, 700, "FIRMA ELECTRÓNICA SIMPLE")
-    can.drawString(100, 670, f"Nombre: {nombre}")
-    can.drawString(100, 650, f"RUT: {rut}")
-    can.drawString(100, 630, f"Correo: {correo}")
-    can.drawString(100, 610, "Fecha de firma: ____________________")
-    can.save()
-    packet.seek(0)
-    firma_pdf = PdfReader(packet)
-    writer.add_page(firma_pdf.pages[0])
-
-
-    # Guardar PDF firmado en memoria
-    output = io.BytesIO()
-    writer.write(output)
-    output.seek(0)
+    # El parseo y la escritura del PDF corren en el pool de procesos
+    try:
+        es_incremental, signed_pdf = await pdf_pool.firmar(original_pdf, nombre, rut, correo, incremental)
+    except ColaPdfLlena as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="La firma del PDF excedió el tiempo máximo")
 
+    # En modo incremental se envían los bytes originales intactos y luego la actualización
+    partes = [original_pdf, signed_pdf] if es_incremental else [signed_pdf]
 
     # Retornar el PDF firmado
     return StreamingResponse(
-        output,
+        iter(partes),
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=firmado_{file.filename}"}
-    )
\ No newline at end of file
+        headers={
+            "Content-Disposition": _content_disposition(f"firmado_{file.filename}"),
+            "Content-Length": str(sum(len(parte) for parte in partes))
+        }
+    )
@@ -0,0 +1,109 @@
+import io
+import os
+import struct
+import sys
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+# Permite importar lib.* igual que lo hace backend/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from lib.firma_pdf import _nombre_entrada, firmar_pdf_incremental
+
+FIRMANTE = ('Ana Pérez', '11.111.111-1', 'ana@empresa.cl', '01-06-2025')
+
+def pdf_tabla_xref(paginas: int = 2) -> bytes:
+    # reportlab escribe una tabla xref clásica
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer)
+    for i in range(paginas):
+        c.drawString(100, 700, f'Página {i + 1}')
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def pdf_xref_stream() -> bytes:
+    # PDF 1.5 mínimo cuyo único xref es un stream /XRef
+    objetos = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>',
+    ]
+    salida = io.BytesIO()
+    salida.write(b'%PDF-1.5\n')
+    offsets = []
+    for numero, cuerpo in enumerate(objetos, start=1):
+        offsets.append(salida.tell())
+        salida.write(b'%d 0 obj\n%s\nendobj\n' % (numero, cuerpo))
+    xref_offset = salida.tell()
+    offsets.append(xref_offset)
+    datos = struct.pack('>BIH', 0, 0, 65535) + b''.join(struct.pack('>BIH', 1, offset, 0) for offset in offsets)
+    salida.write(
+        b'4 0 obj\n<< /Type /XRef /Size 5 /W [1 4 2] /Root 1 0 R /Length %d >>\nstream\n' % len(datos)
+        + datos + b'\nendstream\nendobj\n'
+    )
+    salida.write(b'startxref\n%d\n%%%%EOF\n' % xref_offset)
+    return salida.getvalue()
+
+def _firmar(original: bytes) -> bytes:
+    return original + firmar_pdf_incremental(original, *FIRMANTE)
+
+def _leer(pdf: bytes) -> PdfReader:
+    # strict=True: cualquier offset o /Size mal escrito hace fallar la lectura
+    return PdfReader(io.BytesIO(pdf), strict=True)
+
+@pytest.mark.parametrize('original', [pdf_tabla_xref(), pdf_xref_stream()], ids=['tabla_xref', 'xref_stream'])
+def test_actualizacion_incremental_relee(original):
+    firmado = _firmar(original)
+    assert firmado.startswith(original)
+
+    reader = _leer(firmado)
+    paginas_originales = len(_leer(original).pages)
+    assert len(reader.pages) == paginas_originales + 1
+    assert 'ana@empresa.cl' in reader.pages[-1].extract_text()
+    # Las páginas existentes no cambian
+    for antes, despues in zip(_leer(original).pages, reader.pages):
+        assert antes.mediabox == despues.mediabox
+
+def test_actualizacion_usa_el_mismo_tipo_de_xref():
+    tabla = firmar_pdf_incremental(pdf_tabla_xref(), *FIRMANTE)
+    stream = firmar_pdf_incremental(pdf_xref_stream(), *FIRMANTE)
+    assert b'\nxref\n' in tabla and b'trailer' in tabla
+    assert b'/XRef' in stream and b'\nxref\n' not in stream
+
+@pytest.mark.parametrize('original', [pdf_tabla_xref(), pdf_xref_stream()], ids=['tabla_xref', 'xref_stream'])
+def test_pdf_ya_actualizado(original):
+    una_vez = _firmar(original)
+    dos_veces = _firmar(una_vez)
+    assert dos_veces.startswith(una_vez)
+
+    reader = _leer(dos_veces)
+    assert len(reader.pages) == len(_leer(original).pages) + 2
+    # /Prev encadena con la actualización anterior (PyPDF2 no lo copia al
+    # trailer cuando el xref es un stream, así que se busca en los bytes)
+    prev = int(una_vez[una_vez.rfind(b'startxref'):].split()[1])
+    assert b'/Prev %d' % prev in dos_veces[len(una_vez):]
+
+def test_pdf_cifrado_falla():
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    writer.encrypt('clave')
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    with pytest.raises(ValueError):
+        firmar_pdf_incremental(buffer.getvalue(), *FIRMANTE)
+
+@pytest.mark.parametrize('filename,esperado', [
+    ('contrato.pdf', 'contrato.pdf'),
+    ('../../etc/contrato.pdf', 'contrato.pdf'),
+    ('/tmp/contrato.pdf', 'contrato.pdf'),
+    ('..\\..\\contrato.pdf', 'contrato.pdf'),
+    ('carpeta/', 'documento 3'),
+    ('..', 'documento 3'),
+    ('', 'documento 3'),
+    (None, 'documento 3'),
+])
+def test_nombre_entrada_zip(filename, esperado):
+    # Las entradas del ZIP nunca llevan rutas del cliente
+    assert _nombre_entrada(filename, 2) == esperado
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+# Permite importar lib.* igual que lo hace backend/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+MONGO_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+TEST_DB = 'FirmaSimpleIndicesTest'
+
+# Comandos que leen o modifican por filtro; insert, getMore y similares no planifican
+COMANDOS_CON_PLAN = ('find', 'aggregate', 'findAndModify', 'update', 'delete', 'count', 'distinct')
+# Campos del comando que agrega el driver y que explain no acepta
+CAMPOS_DRIVER = ('$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber', 'apiVersion', 'writeConcern', 'ordered')
+
+PDF = b'%PDF-1.4\n%indices\n'
+
+class Capturador(monitoring.CommandListener):
+    """Guarda los comandos que la capa de datos envía a la base de prueba"""
+
+    def __init__(self):
+        self.comandos = []
+        self.activo = True
+
+    def started(self, event):
+        if self.activo and event.database_name == TEST_DB and event.command_name in COMANDOS_CON_PLAN:
+            if not _chequeo_indices_gridfs(event.command):
+                self.comandos.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def _chequeo_indices_gridfs(comando) -> bool:
+    # GridIn revisa si el bucket está vacío con find_one({}, {'_id': 1}) antes de
+    # crear sus índices; es una consulta del driver, no de la capa de datos
+    coleccion = comando.get('find')
+    return (
+        isinstance(coleccion, str) and coleccion.endswith(('.files', '.chunks'))
+        and not comando.get('filter') and comando.get('projection') == {'_id': 1}
+    )
+
+def _explicables(comando):
+    # explain acepta un solo update/delete por comando
+    comando = {k: v for k, v in comando.items() if k not in CAMPOS_DRIVER}
+    for lista in ('updates', 'deletes'):
+        if lista in comando:
+            for sentencia in comando[lista]:
+                yield {**comando, lista: [sentencia]}
+            return
+    yield comando
+
+def _stages(plan):
+    # Recorre el plan completo: queryPlanner cambia de forma entre versiones de MongoDB
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+def _collection_scans(plan):
+    # Las etapas $lookup informan sus escaneos completos en executionStats
+    if isinstance(plan, dict):
+        if plan.get('collectionScans'):
+            yield plan['collectionScans']
+        for value in plan.values():
+            yield from _collection_scans(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _collection_scans(value)
+
+def _solicitud(nombre, correo):
+    from lib.modelos import SolicitudCreate, UsuarioSolicitud
+    return SolicitudCreate(
+        titulo='Licencia médica',
+        categoria='licencia',
+        descripcion='Solicitud de licencia',
+        fecha='2025-06-01',
+        empleado=UsuarioSolicitud(nombre=nombre, correo=correo, rol='empleado'),
+        supervisor=UsuarioSolicitud(nombre='Jefe', correo='jefe@empresa.cl', rol='supervisor'),
+        hr=UsuarioSolicitud(nombre='RRHH', correo='rrhh@empresa.cl', rol='hr'),
+        documentoId=''
+    )
+
+# Cada escenario llama a la capa de datos tal como lo hacen las rutas de main.py;
+# el test revisa el plan de cada consulta que termina enviando a MongoDB
+def _escenarios(data, ctx):
+    from lib.modelos import DocumentoUpload, FirmaDocumento
+    firma = lambda documento_id: FirmaDocumento(documento_id=documento_id, firmado_por='jefe@empresa.cl', fecha_firma=datetime(2025, 6, 2))
+    return {
+        'get_usuarios': lambda: data.get_usuarios(limit=1),
+        'get_usuarios_cursor': lambda: data.get_usuarios(limit=1, cursor=ctx['cursor_usuarios']),
+        'get_usuario_by_id': lambda: data.get_usuario_by_id(ctx['usuario_id']),
+        'get_usuario_by_correo': lambda: data.get_usuario_by_correo('ana@empresa.cl'),
+        'delete_usuario': lambda: data.delete_usuario(str(ObjectId())),
+        'get_solicitudes': lambda: data.get_solicitudes(limit=1),
+        'get_solicitudes_cursor': lambda: data.get_solicitudes(limit=1, cursor=ctx['cursor_solicitudes']),
+        'get_solicitudes_expandir': lambda: data.get_solicitudes(limit=1, expandir=True),
+        'buscar_solicitudes_fecha': lambda: data.buscar_solicitudes(fecha_desde='2025-06-01', fecha_hasta='2025-06-05'),
+        'buscar_solicitudes_estado': lambda: data.buscar_solicitudes(estado='pendiente'),
+        'buscar_solicitudes_empleado': lambda: data.buscar_solicitudes(empleado_correo='ana@empresa.cl'),
+        'buscar_solicitudes_supervisor': lambda: data.buscar_solicitudes(supervisor_correo='jefe@empresa.cl'),
+        'buscar_solicitudes_categoria': lambda: data.buscar_solicitudes(categoria='licencia', expandir=True),
+        'buscar_solicitudes_texto': lambda: data.buscar_solicitudes(texto='licencia'),
+        'get_solicitud_by_id': lambda: data.get_solicitud_by_id(ctx['solicitud_id']),
+        'update_solicitud': lambda: data.update_solicitud(ctx['solicitud_id'], {'estado': 'pendiente'}),
+        'delete_solicitud': lambda: data.delete_solicitud(str(ObjectId())),
+        # Mismos bytes que el segundo documento del bootstrap: reutiliza su blob
+        'upload_documento_duplicado': lambda: data.upload_documento(
+            PDF + b'luis@empresa.cl', DocumentoUpload(solicitud_id=ctx['solicitud_id'], filename='copia.pdf', content_type='application/pdf')
+        ),
+        'get_documento_by_id': lambda: data.get_documento_by_id(ctx['documento_id']),
+        'get_documentos_by_solicitud': lambda: data.get_documentos_by_solicitud(ctx['solicitud_id']),
+        'get_documentos_firmados': lambda: data.get_documentos_firmados(limit=1),
+        'get_documentos_pendientes_cursor': lambda: data.get_documentos_pendientes(limit=1, cursor=ctx['cursor_documentos']),
+        'buscar_documentos_estado': lambda: data.buscar_documentos(estado='firmado'),
+        'buscar_documentos_firmado_por': lambda: data.buscar_documentos(firmado_por='jefe@empresa.cl'),
+        'buscar_documentos_solicitud': lambda: data.buscar_documentos(solicitud_id=ctx['solicitud_id']),
+        'buscar_documentos_fecha': lambda: data.buscar_documentos(fecha_desde='2025-06-01'),
+        'buscar_documentos_filename': lambda: data.buscar_documentos(filename='contrato'),
+        'read_documento': lambda: data.read_documento(ctx['documento_id']),
+        'verificar_documento': lambda: data.verificar_documento(ctx['documento_id']),
+        'firmar_documento': lambda: data.firmar_documento(firma(str(ObjectId()))),
+        'firmar_documentos': lambda: data.firmar_documentos([firma(str(ObjectId())), firma(str(ObjectId()))]),
+        'delete_documento': lambda: data.delete_documento(str(ObjectId())),
+    }
+
+ESCENARIOS = sorted(_escenarios(None, {}))
+
+@pytest.fixture(scope='module')
+def entorno():
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip('MongoDB no disponible')
+
+    # El listener se registra antes de que lib.mongodb cree su cliente
+    capturador = Capturador()
+    monitoring.register(capturador)
+    os.environ['MONGO_DB'] = TEST_DB
+    from lib import data
+    from lib.modelos import DocumentoUpload, Usuario
+    from lib.mongodb import mongodb
+
+    # Motor queda ligado al primer event loop que usa
+    loop = asyncio.new_event_loop()
+    ctx = {}
+
+    async def bootstrap():
+        await mongodb.connect()
+        await mongodb.ensure_indexes()
+        # Debe poder ejecutarse más de una vez sin error
+        await mongodb.ensure_indexes()
+        # Dos de cada cosa para que los listados devuelvan un cursor siguiente
+        for nombre, correo in (('Ana', 'ana@empresa.cl'), ('Luis', 'luis@empresa.cl')):
+            usuario = await data.add_usuario(Usuario(nombre=nombre, correo=correo, rol='empleado', contraseña='x'))
+            solicitud = await data.add_solicitud(_solicitud(nombre, correo))
+            ctx['usuario_id'], ctx['solicitud_id'] = usuario.id, solicitud['id']
+            ctx['documento_id'] = await data.upload_documento(
+                PDF + correo.encode(),
+                DocumentoUpload(solicitud_id=solicitud['id'], filename=f'contrato_{nombre}.pdf', content_type='application/pdf')
+            )
+        ctx['cursor_usuarios'] = (await data.get_usuarios(limit=1))[1]
+        ctx['cursor_solicitudes'] = (await data.get_solicitudes(limit=1))[1]
+        ctx['cursor_documentos'] = (await data.get_documentos_pendientes(limit=1))[1]
+    loop.run_until_complete(bootstrap())
+
+    yield client[TEST_DB], data, ctx, loop, capturador
+
+    # pymongo no permite quitar un listener registrado
+    capturador.activo = False
+    mongodb.client.close()
+    loop.close()
+    client.drop_database(TEST_DB)
+    client.close()
+
+@pytest.mark.parametrize('name', ESCENARIOS)
+def test_consulta_usa_indice(entorno, name):
+    db, data, ctx, loop, capturador = entorno
+    # Sin caché, para que las búsquedas de usuarios lleguen a la base
+    data.usuarios_cache.clear()
+    capturador.comandos.clear()
+    loop.run_until_complete(_escenarios(data, ctx)[name]())
+    assert capturador.comandos, f"{name} no consultó la base"
+
+    for comando in capturador.comandos:
+        for explicable in _explicables(comando):
+            verbosity = 'executionStats' if 'aggregate' in explicable else 'queryPlanner'
+            plan = db.command({'explain': explicable, 'verbosity': verbosity})
+            stages = set(_stages(plan))
+            assert 'COLLSCAN' not in stages, f"{name} hace COLLSCAN en {explicable}: {stages}"
+            assert not list(_collection_scans(plan)), f"{name} hace COLLSCAN en un $lookup: {explicable}"
+
+def test_correo_unico(entorno):
+    db = entorno[0]
+    with pytest.raises(PyMongoError):
+        db['Usuarios'].insert_one({'nombre': 'Otra', 'correo': 'ana@empresa.cl', 'rol': 'hr', 'contraseña': 'y'})
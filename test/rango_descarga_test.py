@@ -0,0 +1,64 @@
+import os
+import sys
+import pytest
+from urllib.parse import unquote
+from fastapi import HTTPException
+
+# Permite importar main y lib.* igual que al levantar backend/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from main import _content_disposition, _parse_range
+
+LENGTH = 1000
+
+@pytest.mark.parametrize('header,esperado', [
+    ('bytes=0-499', (0, 499)),
+    ('bytes=500-999', (500, 999)),
+    # El final se recorta al tamaño del archivo
+    ('bytes=900-5000', (900, 999)),
+    # Abierto: desde start hasta el final
+    ('bytes=100-', (100, 999)),
+    # Sufijo: los últimos N bytes
+    ('bytes=-200', (800, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes= 10-20', (10, 20)),
+])
+def test_rango_valido(header, esperado):
+    assert _parse_range(header, LENGTH) == esperado
+
+@pytest.mark.parametrize('header', [
+    'items=0-10',
+    'bytes=0-10,20-30',
+    'bytes=abc-def',
+    'bytes=10',
+    'bytes=500-100',
+])
+def test_rango_ignorado(header):
+    # Formas no soportadas o inválidas: se responde el archivo completo
+    assert _parse_range(header, LENGTH) is None
+
+@pytest.mark.parametrize('header,length', [
+    ('bytes=1000-', LENGTH),
+    ('bytes=2000-3000', LENGTH),
+    ('bytes=-0', LENGTH),
+    ('bytes=-10', 0),
+])
+def test_rango_no_satisfacible(header, length):
+    with pytest.raises(HTTPException) as error:
+        _parse_range(header, length)
+    assert error.value.status_code == 416
+    assert error.value.headers['Content-Range'] == f'bytes */{length}'
+
+@pytest.mark.parametrize('filename,ascii_name', [
+    ('contrato.pdf', 'contrato.pdf'),
+    ('Informe – 2025.pdf', 'Informe _ 2025.pdf'),
+    ('合同.pdf', '__.pdf'),
+    ('ñandú.pdf', 'nandu.pdf'),
+    ('con "comillas".pdf', 'con \\"comillas\\".pdf'),
+])
+def test_content_disposition(filename, ascii_name):
+    valor = _content_disposition(filename)
+    # Debe poder enviarse como header (Latin-1) y conservar el nombre original en filename*
+    valor.encode('latin-1')
+    assert f'filename="{ascii_name}"' in valor
+    assert unquote(valor.split("filename*=UTF-8''")[1]) == filename